@@ -77,7 +77,7 @@ then
     done
 fi
 
-watch "python parse.py ./runtime_logs --brief"
+python parse.py ./runtime_logs --follow
 
 echo "Done, requested $counter instances!"
 
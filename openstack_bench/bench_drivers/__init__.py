@@ -25,7 +25,7 @@ def register_driver(name, driver):
 
 
 def get_driver_names():
-    return _AVAILABLE_DRIVERS.keys()
+    return list(_AVAILABLE_DRIVERS.keys())
 
 
 def init_driver(name):
@@ -46,4 +46,4 @@ def _register_all():
 _register_all()
 
 
-DEFAULT_DRIVER = _AVAILABLE_DRIVERS.keys()[0]
+DEFAULT_DRIVER = next(iter(_AVAILABLE_DRIVERS))
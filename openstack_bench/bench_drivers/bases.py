@@ -29,6 +29,13 @@ class BenchDriverBase(object):
     def build_graph(self):
         raise NotImplementedError()
 
+    def interval_queries(self, graph):
+        """ The (targets, cut targets, cut edge) of extract_intervals.
+
+        They are required in advance by the streaming statistics engine.
+        """
+        return []
+
     def build_statistics(self, s_engine, report):
         raise NotImplementedError()
 
@@ -12,11 +12,37 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+from openstack_bench.bench_drivers import bases
 from openstack_bench.bench_drivers import register_driver
 from openstack_bench.log_parser.state_graph import MasterGraph
 from openstack_bench.releases import Release
 
-import bases
+
+# NOTE: the targets are (from node, to node) of the intervals.
+_i_apif = frozenset([(0, 20)])
+_i_api = frozenset([(0, 20), (0, 2)])
+_i_apis = frozenset([(0, 2)])
+_i_atc = frozenset([(1, 3)])
+_i_con1 = frozenset([(2, 5), (2, 21)])
+_i_cts = frozenset([(4, 6)])
+_i_sch = frozenset([(5, 11), (5, 12)])
+_i_stc = frozenset([(10, 13), (10, 22)])
+_i_con2 = frozenset([(11, 14)])
+_i_contc = frozenset([(13, 15)])
+_i_com = frozenset([(14, 2), (14, 23), (14, 25), (14, 26)])
+_i_con = frozenset(_i_con1 | _i_con2)
+
+_i_fil = frozenset([(6, 10)])
+_i_cac = frozenset([(7, 9)])
+_i_gap = frozenset([(8, 16), (8, 23), (8, 24)])
+_i_sus = frozenset([(0, 25)])
+_i_nvh = frozenset([(0, 22)])
+_i_ret = frozenset([(0, 16)])
+
+_i_all = [_i_api, _i_con, _i_sch, _i_com]
+_i_cut = [_i_api, _i_con1, _i_con2, _i_sch, _i_com, _i_atc, _i_cts,
+          _i_stc, _i_contc, _i_fil, _i_cac, _i_gap, _i_sus, _i_apif,
+          _i_nvh, _i_ret, _i_apis]
 
 
 def debug(*args, **kwargs):
@@ -218,33 +244,11 @@ class BenchDriverScheduler(bases.BenchDriverBase):
 
         return master
 
+    def interval_queries(self, graph):
+        return [(_i_all, _i_cut, graph.get_edge(16, 2))]
+
     def build_statistics(self, s_engine, report):
-        _i_apif = frozenset([(0, 20)])
-        _i_api = frozenset([(0, 20), (0, 2)])
-        _i_apis = frozenset([(0, 2)])
-        _i_atc = frozenset([(1, 3)])
-        _i_con1 = frozenset([(2, 5), (2, 21)])
-        _i_cts = frozenset([(4, 6)])
-        _i_sch = frozenset([(5, 11), (5, 12)])
-        _i_stc = frozenset([(10, 13), (10, 22)])
-        _i_con2 = frozenset([(11, 14)])
-        _i_contc = frozenset([(13, 15)])
-        _i_com = frozenset([(14, 2), (14, 23), (14, 25), (14, 26)])
-        _i_con = frozenset(_i_con1 | _i_con2)
-
-        _i_fil = frozenset([(6, 10)])
-        _i_cac = frozenset([(7, 9)])
-        _i_gap = frozenset([(8, 16), (8, 23), (8, 24)])
-        _i_sus = frozenset([(0, 25)])
-        _i_nvh = frozenset([(0, 22)])
-        _i_ret = frozenset([(0, 16)])
-
-        _i_all = [_i_api, _i_con, _i_sch, _i_com]
-        _i_cut = [_i_api, _i_con1, _i_con2, _i_sch, _i_com, _i_atc, _i_cts,
-                  _i_stc, _i_contc, _i_fil, _i_cac, _i_gap, _i_sus, _i_apif,
-                  _i_nvh, _i_ret, _i_apis]
         cut_edge = s_engine.graph.get_edge(16, 2)
-
         all_, cut, cutted = s_engine.extract_intervals(_i_all, _i_cut, cut_edge)
 
         report.register("active schedulers",
@@ -265,7 +269,7 @@ class BenchDriverScheduler(bases.BenchDriverBase):
         report.register("compute fail requests",
                         s_engine.requests_by_state.get("COMPUTE FAIL", 0))
         report.register("error requests",
-                        len(s_engine.error_instances))
+                        s_engine.error_requests)
         report.blank()
         report.register("total valid queries",
                         s_engine.count(3))
@@ -308,6 +312,12 @@ class BenchDriverScheduler(bases.BenchDriverBase):
         report.register("time refresh avg", cut[_i_cac].average())
         report.register("time gap avg", cut[_i_gap].average())
         report.blank()
+        report.register_percentiles("time query", cut[_i_sus])
+        report.register_percentiles("time sched", cut[_i_sch])
+        report.register_percentiles("time filter", cut[_i_fil])
+        report.register_percentiles("time refresh", cut[_i_cac])
+        report.register_percentiles("time compu", cut[_i_com])
+        report.blank()
         sum_query_avg = cut[_i_api].average()\
                         + cut[_i_atc].average()\
                         + cut[_i_con1].average()\
@@ -353,6 +363,9 @@ class BenchDriverScheduler(bases.BenchDriverBase):
                         / float(s_engine.count(1) - s_engine.count(20)) * 100)
         report.register("percent api fail",
                         s_engine.count(20) / float(s_engine.count(1)) * 100)
+        report.blank()
+        report.register("hist query", cut[_i_sus].histogram())
+        report.register("hist sched", cut[_i_sch].histogram())
 
 
 # TODO: implement this in the metaclass
@@ -31,6 +31,13 @@ def _register_opts():
         cfg.StrOpt("bench_driver",
                    choices=bench_drivers.get_driver_names(),
                    default=bench_drivers.DEFAULT_DRIVER),
+        cfg.BoolOpt("event_sink",
+                    default=True),
+        cfg.StrOpt("event_mode",
+                   choices=["sync", "buffered"],
+                   default="buffered"),
+        cfg.FloatOpt("event_flush_interval",
+                     default=0.5),
     ]
 
     NOVA_PATCHER_GROUP = "nova_patcher"
@@ -0,0 +1,347 @@
+# Copyright (c) 2016 Yingxin Cheng
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+""" Benchmarks of the log parser.
+
+Usage: python -m openstack_bench.log_parser.benchmark <name> [args]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+from os import path
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from openstack_bench import bench_drivers
+from openstack_bench.log_parser import synthetic
+from openstack_bench.log_parser.log_parser import LogCollector
+from openstack_bench.log_parser.log_parser import LogFile
+from openstack_bench.log_parser.parser_engine import ParserEngine
+from openstack_bench.log_parser.statistics import Engine
+
+
+def _load_files(folder):
+    log_files = []
+    relation = {}
+    for f in sorted(os.listdir(folder)):
+        file_dir = path.join(folder, f)
+        if f.startswith("BENCH") and f.endswith(".log") \
+                and path.isfile(file_dir):
+            log_files.append(LogFile(f, file_dir, relation))
+    return log_files
+
+
+class _LegacyLogFile(object):
+    def __init__(self, name):
+        self.name = name
+        self.host = None
+        self.service = None
+
+
+class _LegacyLogLine(object):
+    """ The dict-based LogLine of the baseline, for comparison.
+
+    It is copied verbatim without the methods to resolve the relations,
+    except that the length of instance_info is compared by ==.
+    """
+    _sentinal = object()
+
+    def __init__(self, line, log_file):
+        # line, filename
+        self.filename = log_file.name
+        self.line = line
+
+        pieces = line.split()
+
+        # seconds
+        self.time = pieces[1]
+        time_pieces = pieces[1].split(":")
+        self.seconds = int(time_pieces[0]) * 3600 + \
+            int(time_pieces[1]) * 60 + \
+            float(time_pieces[2])
+
+        # service, host
+        pieces7 = None
+        index = 0
+        for piece in pieces:
+            if piece.startswith("BENCH-"):
+                pieces7 = piece
+                break
+            index += 1
+        pieces7 = pieces7.split('-')
+        host_pieces = pieces7[2:]
+        host_pieces[-1] = pieces7[-1][:-1]
+        self.host = '-'.join(host_pieces)
+        self.service = pieces7[1]
+
+        # instance_id, instance_name
+        instance_info = pieces[index+1]
+        self.instance_id = "?"
+        self.instance_name = "?"
+        if instance_info == "--":
+            pass
+        elif "," in instance_info:
+            instance_info = instance_info.split(",")
+            self.instance_name = instance_info[0]
+            self.instance_id = instance_info[1]
+        elif len(instance_info) == 36:
+            self.instance_id = instance_info
+        else:
+            self.instance_name = instance_info
+
+        # request_id, action
+        self.request_id = pieces[index-3][5:]
+        self.action = " ".join(pieces[index+2:])
+
+        # validations
+        if log_file.host is None:
+            log_file.host = self.host
+        elif log_file.host != self.host:
+            raise RuntimeError("Host and service mismatch in log %s"
+                               % self.filename)
+
+        if log_file.service is None:
+            log_file.service = self.service
+        elif log_file.service != self.service:
+            raise RuntimeError("Host and service mismatch in log %s"
+                               % self.filename)
+
+        # others
+        self.correct = True
+        self.prv = None
+        self.nxt = None
+
+    @property
+    def ident(self):
+        assert self.instance_name is not None
+        return self.instance_name
+
+    def __repr__(self):
+        return str(self.seconds) + " " + \
+            self.time + " " + \
+            self.service + " " + \
+            self.host + " " + \
+            self.request_id + " " + \
+            self.instance_id + " " + \
+            self.instance_name + " " + \
+            self.action
+
+
+def _load_legacy_logs(log_files):
+    """ Parse the raw lines of log_files as the baseline LogFile did. """
+    logs = []
+    for log_file in log_files:
+        legacy_file = _LegacyLogFile(log_file.name)
+        prv = None
+        with open(log_file.path, 'r') as reader:
+            for line in reader:
+                if "BENCH-" not in line:
+                    continue
+                if "Bench initiated!" in line:
+                    continue
+                lg = _LegacyLogLine(line, legacy_file)
+                logs.append(lg)
+                # link the logs
+                if prv is not None:
+                    prv.nxt = lg
+                    lg.prv = prv
+                prv = lg
+    return logs
+
+
+def _deep_size(logs):
+    seen = set()
+    size = 0
+    for log in logs:
+        members = [log]
+        if hasattr(log, "__dict__"):
+            members.append(log.__dict__)
+            values = log.__dict__.items()
+        else:
+            values = [(slot, getattr(log, slot)) for slot in log.__slots__]
+        for key, value in values:
+            # links and the file name are shared with other objects
+            if key not in ("filename", "prv", "nxt"):
+                members.append(value)
+        for member in members:
+            if id(member) not in seen:
+                seen.add(id(member))
+                size += sys.getsizeof(member)
+    return size
+
+
+def bench_memory(args):
+    log_files = _load_files(args.folder)
+    logs = [log for log_file in log_files for log in log_file.log_lines]
+    if not logs:
+        print("No oslo.log files in %s" % args.folder)
+        return
+    legacy_logs = _load_legacy_logs(log_files)
+    if len(legacy_logs) != len(logs):
+        print("Warn! %d legacy log lines against %d"
+              % (len(legacy_logs), len(logs)))
+
+    compact = _deep_size(logs)
+    legacy = _deep_size(legacy_logs)
+    print("log lines:        %d" % len(logs))
+    print("legacy bytes:     %d (%.1f per line)"
+          % (legacy, float(legacy) / len(logs)))
+    print("compact bytes:    %d (%.1f per line)"
+          % (compact, float(compact) / len(logs)))
+    print("saved percent:    %.2f" % ((1 - float(compact) / legacy) * 100))
+
+
+def bench_nesting(args):
+    driver_obj = bench_drivers.init_driver(args.driver)
+    print("retries  leaf/request  parse seconds  us/leaf")
+    for retries in args.retries:
+        folder = tempfile.mkdtemp()
+        try:
+            synthetic.write_retry_logs(folder, args.requests, retries)
+            log_collector = LogCollector(folder, driver_obj)
+            log_collector.process_logs()
+            graph = driver_obj.build_graph()
+            graph.compile()
+
+            start = time.time()
+            instances = ParserEngine(graph, log_collector).parse()
+            seconds = time.time() - start
+        finally:
+            shutil.rmtree(folder)
+
+        failed = sum(1 for ins in instances.values() if ins.is_failed)
+        if failed:
+            print("%d of %d requests failed to parse"
+                  % (failed, len(instances)))
+        leaves = sum(len(list(ins)) for ins in instances.values())
+        print("%7d  %12.1f  %13.3f  %7.1f"
+              % (retries, float(leaves) / len(instances), seconds,
+                 seconds * 1000000 / leaves))
+
+
+def _interpreter():
+    return "%s %s" % (platform.python_implementation(),
+                      platform.python_version())
+
+
+def _parse_once(folder, driver_obj):
+    """ Return the seconds to load, parse and aggregate the logs. """
+    start = time.time()
+    log_collector = LogCollector(folder, driver_obj, cache=False)
+    log_collector.process_logs()
+    loaded = time.time()
+
+    graph = driver_obj.build_graph()
+    graph.compile()
+    instances = ParserEngine(graph, log_collector).parse()
+    parsed = time.time()
+
+    Engine(graph, instances, log_collector)
+    aggregated = time.time()
+
+    lines = sum(len(log_file.log_lines)
+                for log_file in log_collector.log_files)
+    return lines, loaded - start, parsed - loaded, aggregated - parsed
+
+
+def bench_throughput(args):
+    if args.python:
+        # NOTE: run in every interpreter from the folder of the package.
+        root = path.dirname(path.dirname(path.dirname(
+            path.abspath(__file__))))
+        print("interpreter         lines  load s  parse s  stats s  lines/s")
+        for python in args.python:
+            sys.stdout.flush()
+            try:
+                ret = subprocess.call(
+                    [python, "-m", "openstack_bench.log_parser.benchmark",
+                     "throughput", path.abspath(args.folder),
+                     "--driver", args.driver, "--repeat", str(args.repeat),
+                     "--row"], cwd=root)
+            except OSError as e:
+                ret = e
+            if ret:
+                print("%-18s failed: %s" % (python, ret))
+        return
+
+    driver_obj = bench_drivers.init_driver(args.driver)
+    best = None
+    stdout = sys.stdout
+    for _ in range(args.repeat):
+        # the reports of the parser are not measured
+        sys.stdout = open(os.devnull, "w")
+        try:
+            result = _parse_once(args.folder, driver_obj)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        if best is None or sum(result[1:]) < sum(best[1:]):
+            best = result
+
+    lines, load, parse, stats = best
+    if not args.row:
+        print("interpreter         lines  load s  parse s  stats s  lines/s")
+    print("%-18s %6d %7.3f %8.3f %8.3f %8d"
+          % (_interpreter(), lines, load, parse, stats,
+             lines / (load + parse + stats)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers()
+
+    memory = subparsers.add_parser(
+        "memory", help="Memory of parsed LogLines against the dict-based "
+                       "ones of the baseline, from the same oslo.log "
+                       "files.")
+    memory.add_argument("folder", help="The logs are in that folder.")
+    memory.set_defaults(func=bench_memory)
+
+    nesting = subparsers.add_parser(
+        "nesting", help="Parse time of synthetic retry-heavy requests by "
+                        "the number of leaf instances per request.")
+    nesting.add_argument("--driver", default=bench_drivers.DEFAULT_DRIVER,
+                         choices=bench_drivers.get_driver_names())
+    nesting.add_argument("--requests", type=int, default=200)
+    nesting.add_argument("--retries", type=int, nargs="+",
+                         default=[0, 4, 16, 64])
+    nesting.set_defaults(func=bench_nesting)
+
+    throughput = subparsers.add_parser(
+        "throughput", help="Lines per second to load, parse and aggregate "
+                           "the logs, by interpreters.")
+    throughput.add_argument("folder", help="The logs are in that folder.")
+    throughput.add_argument("--driver", default=bench_drivers.DEFAULT_DRIVER,
+                            choices=bench_drivers.get_driver_names())
+    throughput.add_argument("--repeat", type=int, default=3,
+                            help="The best of the runs is reported.")
+    throughput.add_argument("--python", nargs="+",
+                            help="Run with these interpreters instead, e.g. "
+                                 "python2 python3 pypy.")
+    throughput.add_argument("--row", action="store_true",
+                            help=argparse.SUPPRESS)
+    throughput.set_defaults(func=bench_throughput)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,76 @@
 import collections
+import datetime
+import mmap
 import os
 from os import path
+import sys
+import time
 
-# TODO: extract the logics of emitting and parsing logging fields (low
-# priority), splitted by @-@
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    from sys import intern
+except ImportError:
+    # NOTE: a builtin before Python 3
+    pass
+
+from openstack_bench.utils import bench_format
+from openstack_bench.utils.optional import import_numpy
 
 
 class LogLine(object):
+    # NOTE: a large run has millions of log lines, slots and interned strings
+    # keep each of them small.
+    __slots__ = ("filename", "line", "seconds", "host", "service",
+                 "instance_id", "instance_name", "request_id", "action",
+                 "correct", "prv", "nxt")
     _sentinal = object()
 
-    def __init__(self, line, log_file):
+    def __init__(self, line, log_file, stamps=None):
         # line, filename
         self.filename = log_file.name
         self.line = line
 
+        pos = line.find(bench_format.MARKER)
+        if pos != -1:
+            self._parse_event(line, pos, log_file)
+        else:
+            self._parse_legacy(line, log_file, stamps)
+
+        # validations
+        if log_file.host is None:
+            log_file.host = self.host
+        elif log_file.host != self.host:
+            raise RuntimeError("Host and service mismatch in log %s"
+                               % self.filename)
+
+        if log_file.service is None:
+            log_file.service = self.service
+        elif log_file.service != self.service:
+            raise RuntimeError("Host and service mismatch in log %s"
+                               % self.filename)
+
+        # others
+        self.correct = True
+        self.prv = None
+        self.nxt = None
+
+    def _parse_legacy(self, line, log_file, stamps):
         pieces = line.split()
 
         # seconds
-        self.time = pieces[1]
-        time_pieces = pieces[1].split(":")
-        self.seconds = int(time_pieces[0]) * 3600 + \
-            int(time_pieces[1]) * 60 + \
-            float(time_pieces[2])
+        if log_file.base is None:
+            log_file.base = _hour_epoch(pieces[0], 0)
+        if stamps is None:
+            self.seconds = _decode_timestamp(pieces[0], pieces[1],
+                                             log_file.base)
+        else:
+            # NOTE: decoded in a batch by LogFile.
+            self.seconds = None
+            stamps.append((self, pieces[0], pieces[1]))
 
         # service, host
         pieces7 = None
@@ -34,45 +83,48 @@ class LogLine(object):
         pieces7 = pieces7.split('-')
         host_pieces = pieces7[2:]
         host_pieces[-1] = pieces7[-1][:-1]
-        self.host = '-'.join(host_pieces)
-        self.service = pieces7[1]
+        self.host = intern('-'.join(host_pieces))
+        self.service = intern(pieces7[1])
 
         # instance_id, instance_name
-        instance_info = pieces[index+1]
-        self.instance_id = "?"
-        self.instance_name = "?"
-        if instance_info == "--":
-            pass
-        elif "," in instance_info:
-            instance_info = instance_info.split(",")
-            self.instance_name = instance_info[0]
-            self.instance_id = instance_info[1]
-        elif len(instance_info) is 36:
-            self.instance_id = instance_info
-        else:
-            self.instance_name = instance_info
+        instance_id, instance_name = \
+            bench_format.split_instance(pieces[index+1])
+        self.instance_id = intern(instance_id)
+        self.instance_name = intern(instance_name)
 
         # request_id, action
         self.request_id = pieces[index-3][5:]
-        self.action = " ".join(pieces[index+2:])
+        self.action = intern(" ".join(pieces[index+2:]))
+
+    def _parse_event(self, line, pos, log_file):
+        (seconds, service, host, self.request_id, instance_id,
+         instance_name, action) = bench_format.parse_event(line, pos)
+        if log_file.base is None:
+            log_file.base = _day_epoch(int(seconds.partition(".")[0]))
+        self.seconds = _decode_epoch(seconds, log_file.base)
+        self.service = intern(service)
+        self.host = intern(host)
+        self.instance_id = intern(instance_id)
+        self.instance_name = intern(instance_name)
+        self.action = intern(action)
+
+    def decode_seconds(self, base):
+        """ Decode the seconds of the line from base. """
+        pos = self.line.find(bench_format.MARKER)
+        if pos == -1:
+            date, clock = self.line.split(None, 2)[:2]
+            return _decode_timestamp(date, clock, base)
+        return _decode_epoch(bench_format.parse_event(self.line, pos)[0],
+                             base)
 
-        # validations
-        if log_file.host is None:
-            log_file.host = self.host
-        elif log_file.host != self.host:
-            raise RuntimeError("Host and service mismatch in log %s"
-                               % self.filename)
-
-        if log_file.service is None:
-            log_file.service = self.service
-        elif log_file.service != self.service:
-            raise RuntimeError("Host and service mismatch in log %s"
-                               % self.filename)
-
-        # others
-        self.correct = True
-        self.prv = None
-        self.nxt = None
+    @property
+    def time(self):
+        pos = self.line.find(bench_format.MARKER)
+        if pos == -1:
+            return self.line.split(None, 2)[1]
+        seconds = float(bench_format.parse_event(self.line, pos)[0])
+        return datetime.datetime.fromtimestamp(seconds)\
+            .strftime("%H:%M:%S.%f")[:-3]
 
     @property
     def ident(self):
@@ -80,7 +132,7 @@ class LogLine(object):
         return self.instance_name
 
     def __repr__(self):
-        return str(self.seconds) + " " + \
+        return repr(self.seconds) + " " + \
             self.time + " " + \
             self.service + " " + \
             self.host + " " + \
@@ -90,22 +142,17 @@ class LogLine(object):
             self.action
 
     def get_relation(self, relation):
+        """ Index the first line with both instance id and name by id. """
         if self.instance_id == "?" or self.instance_name == "?":
             return True
 
-        rel = Relation(self.request_id, self.instance_id, self.instance_name,
-                       self.line, self.filename)
-        rel_record = relation.get(rel.instance_id, None)
-        if not rel_record:
-            relation[rel.instance_id] = rel
-            return True
-        else:
-            if rel.instance_id != rel_record.instance_id or \
-                    rel.instance_name != rel_record.instance_name:
-                print("Mismatch: %s, %s" %
-                      (rel_record.get_line(), rel.get_line()))
-                return False
-            return True
+        rel = relation.get(self.instance_id)
+        if rel is None:
+            relation[self.instance_id] = self
+        elif rel.instance_name != self.instance_name:
+            print("Mismatch: %s, %s" % (rel.get_line(), self.get_line()))
+            return False
+        return True
 
     def assert_c(self, service, key_word):
         """ Deprecated """
@@ -141,20 +188,20 @@ class LogLine(object):
                 raise RuntimeError("Cannot parse relation ?-?!")
 
         if self.instance_id == "?":
-            rel = relation_name.get(self.instance_name, None)
-            if not rel:
+            rel = relation_name.get(self.instance_name)
+            if rel is None:
                 return self.instance_name
             self.instance_id = rel.instance_id
             return True
         elif self.instance_name == "?":
-            rel = relation_id.get(self.instance_id, None)
-            if not rel:
+            rel = relation_id.get(self.instance_id)
+            if rel is None:
                 return self.instance_id
             self.instance_name = rel.instance_name
             return True
         else:
-            rel = relation_id.get(self.instance_id, None)
-            if not rel:
+            rel = relation_id.get(self.instance_id)
+            if rel is None:
                 return self.instance_id
             if self.instance_name != rel.instance_name:
                 raise RuntimeError("Apply logline mismatch, rel: %s, log: %s"
@@ -164,21 +211,169 @@ class LogLine(object):
     def get_line(self):
         return self.filename + ": " + self.line
 
+    def __getstate__(self):
+        # NOTE: links are rebuilt by LogFile after unpickling, pickling them
+        # directly recurses through the whole file.
+        return tuple(getattr(self, slot) for slot in self.__slots__[:-2])
+
+    def __setstate__(self, state):
+        (self.filename, self.line, self.seconds, host, service,
+         instance_id, instance_name, self.request_id, action,
+         self.correct) = state
+        self.host = intern(host)
+        self.service = intern(service)
+        self.instance_id = intern(instance_id)
+        self.instance_name = intern(instance_name)
+        self.action = intern(action)
+        self.prv = None
+        self.nxt = None
 
-class Relation(object):
-    def __init__(self, r_id, i_id, i_name, line, filename):
-        self.line = line
-        self.filename = filename
-        self.request_id = r_id
-        self.instance_id = i_id
-        self.instance_name = i_name
 
-    def get_line(self):
-        return self.filename + ": " + self.line
+# epoch seconds of the local "YYYY-MM-DD" dates and hours
+_hour_epochs = {}
+
+
+def _hour_epoch(date, hour):
+    key = (date, hour)
+    epoch = _hour_epochs.get(key)
+    if epoch is None:
+        epoch = time.mktime((int(date[:4]), int(date[5:7]), int(date[8:10]),
+                             hour, 0, 0, 0, 0, -1))
+        _hour_epochs[key] = epoch
+    return epoch
+
+
+def _day_epoch(seconds):
+    """ Return the epoch of the local midnight before the epoch seconds. """
+    return _hour_epoch(time.strftime("%Y-%m-%d", time.localtime(seconds)), 0)
+
+
+# NOTE: the seconds are measured from the base epoch of the run, as the
+# floats of the epoch seconds themselves are too coarse for the sums and
+# the differences of the statistics.
+def _decode_epoch(seconds, base):
+    """ Decode the recorded epoch seconds into the seconds from base. """
+    whole, _, fraction = seconds.partition(".")
+    ticks = (int(whole) - base) * 10 ** len(fraction) + int(fraction or 0)
+    return float(ticks) / 10 ** len(fraction)
+
+
+def _decode_timestamp(date, clock, base):
+    """ Decode the local date and "HH:MM:SS.fff" clock into the seconds
+    from base.
+
+    The seconds are counted in ticks of the fraction, so that the result
+    is exactly the same as _decode_timestamps.
+    """
+    whole, _, fraction = clock[6:].partition(".")
+    ticks = (_hour_epoch(date, int(clock[:2])) - base + int(clock[3:5]) * 60
+             + int(whole)) * 10 ** len(fraction) + int(fraction or 0)
+    return float(ticks) / 10 ** len(fraction)
+
+
+def _decode_timestamps(dates, clocks, base):
+    """ Decode the columns of dates and clocks at once, by NumPy. """
+    numpy = import_numpy()
+    clocks = numpy.array(clocks, dtype=numpy.bytes_)
+    width = clocks.dtype.itemsize
+    chars = clocks.view(numpy.uint8).reshape(len(clocks), width)
+    digits = chars.astype(numpy.int64) - ord("0")
+    lengths = (chars != 0).sum(axis=1)
+
+    hours = digits[:, 0] * 10 + digits[:, 1]
+    ticks = (digits[:, 3] * 10 + digits[:, 4]) * 60 \
+        + digits[:, 6] * 10 + digits[:, 7]
+    scales = numpy.ones(len(clocks), dtype=numpy.int64)
+    for i in range(9, width):
+        in_fraction = i < lengths
+        ticks = numpy.where(in_fraction, ticks * 10 + digits[:, i], ticks)
+        scales = numpy.where(in_fraction, scales * 10, scales)
+
+    days, day_index = numpy.unique(numpy.array(dates), return_inverse=True)
+    keys, key_index = numpy.unique(day_index * 24 + hours,
+                                   return_inverse=True)
+    epochs = numpy.array([_hour_epoch(days[key // 24], int(key % 24)) - base
+                          for key in keys])
+    return (epochs[key_index] * scales + ticks) / scales
+
+
+# NOTE: the NumPy batch costs more than it saves for small files.
+MIN_BATCH_STAMPS = 256
+
+
+def _decode_stamps(stamps, base):
+    """ Set the seconds of the legacy lines deferred by LogFile. """
+    if len(stamps) < MIN_BATCH_STAMPS or import_numpy() is None:
+        for lg, date, clock in stamps:
+            lg.seconds = _decode_timestamp(date, clock, base)
+        return
+    seconds = _decode_timestamps([stamp[1] for stamp in stamps],
+                                 [stamp[2] for stamp in stamps], base)
+    for stamp, second in zip(stamps, seconds.tolist()):
+        stamp[0].seconds = second
+
+
+def _iter_bench_lines(log_file, start=0, end=None):
+    """ Yield the lines containing "BENCH-" from a mmapped log file.
+
+    Only the matched lines are materialized, the other lines of the
+    services are skipped at the byte level. The range [start, end) must
+    begin and end at line boundaries.
+    """
+    with open(log_file, 'rb') as reader:
+        size = os.fstat(reader.fileno()).st_size
+        if end is None or end > size:
+            end = size
+        if start >= end:
+            return
+        mm = mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            pos = mm.find(b"BENCH-", start, end)
+            while pos != -1:
+                line_start = mm.rfind(b"\n", start, pos)
+                if line_start == -1:
+                    line_start = start
+                else:
+                    line_start += 1
+                line_end = mm.find(b"\n", pos, end)
+                if line_end == -1:
+                    line_end = end
+                else:
+                    line_end += 1
+                line = mm[line_start:line_end]
+                if not isinstance(line, str):
+                    line = line.decode("utf-8", "replace")
+                yield line
+                pos = mm.find(b"BENCH-", line_end, end)
+        finally:
+            mm.close()
+
+
+def _split_chunks(log_file, size, chunk_size):
+    """ Split a file into byte ranges of about chunk_size at newlines. """
+    bounds = [0]
+    with open(log_file, 'rb') as reader:
+        for offset in range(chunk_size, size, chunk_size):
+            if offset <= bounds[-1]:
+                continue
+            reader.seek(offset)
+            reader.readline()
+            pos = reader.tell()
+            if pos >= size:
+                break
+            bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+# NOTE: the forked workers of a service flush their buffered events every
+# event_flush_interval, 0.5s by default, so that the events read in follow
+# mode are only in time order after a while.
+FOLLOW_WINDOW = 2.0
 
 
 class LogFile(object):
-    def __init__(self, name, log_file, relation):
+    def __init__(self, name, log_file, relation, follow=False, chunk=None):
         self.service = None
         self.host = None
         self.name = name
@@ -190,25 +385,174 @@ class LogFile(object):
 
         self.lo = None
         self.hi = None
+        self.offset = 0
+        # the seconds of log_lines before they are corrected
+        self.raw_seconds = None
+        # the epoch the seconds are measured from
+        self.base = None
+
+        # follow mode
+        self.path = log_file
+        self.following = follow
+        self._pos = 0
+        self._remain = ""
+        # the logs read but not yet in time order, see follow()
+        self.held_logs = []
+
+        # False if the loading stopped at a relation failure
+        self.complete = True
+
+        if follow:
+            return
 
-        with open(log_file, 'r') as reader:
-            prv = None
-            for line in reader:
-                if "BENCH-" not in line:
-                    continue
-                if "Bench initiated!" in line:
-                    continue
-                lg = LogLine(line, self)
-                if not lg.get_relation(relation):
-                    print("Fail getting relation for line %s in file %s!"
-                          % (lg, self.name))
-                    return
-                self.log_lines.append(lg)
-                # link the logs
-                if prv is not None:
-                    prv.nxt = lg
-                    lg.prv = prv
-                prv = lg
+        start, end = chunk or (0, None)
+        stamps = []
+        for line in _iter_bench_lines(log_file, start, end):
+            if self._append(line, relation, stamps) is False:
+                self.complete = False
+                break
+        _decode_stamps(stamps, self.base)
+        self._order()
+
+    @classmethod
+    def join(cls, chunks):
+        """ Join the LogFiles of the consecutive chunks of a file.
+
+        The result is the same as loading the whole file, relations are
+        replayed by the collector.
+        """
+        f = chunks[0]
+        for chunk in chunks[1:]:
+            if not f.complete:
+                break
+            if chunk.host is not None:
+                if f.host is None:
+                    f.host = chunk.host
+                    f.service = chunk.service
+                elif f.host != chunk.host or f.service != chunk.service:
+                    raise RuntimeError("Host and service mismatch in log %s"
+                                       % f.name)
+            if f.base is None:
+                f.base = chunk.base
+            else:
+                chunk.rebase(f.base)
+            f.log_lines.extend(chunk.log_lines)
+            f.complete = chunk.complete
+        if len(chunks) > 1:
+            f._link()
+            f._order()
+        return f
+
+    def _order(self):
+        # NOTE: the forked workers of a service flush their buffered events
+        # in batches, so the lines are not strictly in time order.
+        lines = self.log_lines
+        if any(lines[i].seconds < lines[i - 1].seconds
+               for i in range(1, len(lines))):
+            lines.sort(key=lambda lg: lg.seconds)
+            self._link()
+
+    def _append(self, line, relation, stamps=None):
+        lg = self._parse(line, relation, stamps)
+        if lg:
+            self._add(lg)
+        return lg
+
+    def _parse(self, line, relation, stamps=None):
+        if "BENCH-" not in line:
+            return None
+        if "Bench initiated" in line:
+            return None
+        lg = LogLine(line, self, stamps)
+        if relation is not None and not lg.get_relation(relation):
+            print("Fail getting relation for line %s in file %s!"
+                  % (lg, self.name))
+            return False
+        return lg
+
+    def _add(self, lg):
+        if self.raw_seconds is not None:
+            # NOTE: only corrected in follow mode, which decodes each line.
+            self.raw_seconds.append(lg.seconds)
+            lg.seconds -= self.offset
+        # link the logs
+        if self.log_lines:
+            prv = self.log_lines[-1]
+            prv.nxt = lg
+            lg.prv = prv
+        self.log_lines.append(lg)
+
+    def follow(self, relation):
+        """ Read the lines appended since the last call, return new logs.
+
+        Like _order() in loading, the new logs are in time order. They are
+        held until they are FOLLOW_WINDOW seconds older than the last read
+        log, or until a read finds nothing new.
+        """
+        new_logs = []
+        if not self.following:
+            return new_logs
+
+        with open(self.path, 'r') as reader:
+            reader.seek(self._pos)
+            data = reader.read()
+            self._pos = reader.tell()
+
+        held = self.held_logs
+        lines = (self._remain + data).split("\n")
+        # the last piece is an incomplete line or empty
+        self._remain = lines.pop()
+        for line in lines:
+            lg = self._parse(line + "\n", relation)
+            if lg is False:
+                self.following = False
+                break
+            elif lg is not None:
+                held.append(lg)
+        if not held:
+            return new_logs
+
+        held.sort(key=lambda lg: lg.seconds)
+        if data and self.following:
+            bound = held[-1].seconds - FOLLOW_WINDOW
+            count = 0
+            while count < len(held) and held[count].seconds <= bound:
+                count += 1
+        else:
+            count = len(held)
+        new_logs = held[:count]
+        self.held_logs = held[count:]
+
+        # NOTE: the held logs are not corrected yet.
+        if new_logs and self.log_lines and new_logs[0].seconds \
+                < self.log_lines[-1].seconds + self.offset:
+            print("Log %s is later than the follow window in file %s!"
+                  % (new_logs[0], self.name))
+        for lg in new_logs:
+            self._add(lg)
+        return new_logs
+
+    def _link(self):
+        prv = None
+        for lg in self.log_lines:
+            lg.prv = prv
+            if prv is not None:
+                prv.nxt = lg
+            prv = lg
+        if prv is not None:
+            prv.nxt = None
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._link()
+
+    def truncate(self, index):
+        self.complete = False
+        self.log_lines = self.log_lines[:index]
+        if self.raw_seconds is not None:
+            self.raw_seconds = self.raw_seconds[:index]
+        if self.log_lines:
+            self.log_lines[-1].nxt = None
 
     def set_offset(self, lo, hi):
         # deprecated
@@ -228,9 +572,35 @@ class LogFile(object):
         else:
             return True
 
+    def rebase(self, base):
+        """ Measure the seconds of logs from another base epoch.
+
+        The seconds are decoded again, so that they are exactly the same
+        as decoded from the base in the first place.
+        """
+        if self.base is None or self.base == base:
+            self.base = base
+            return
+        self.base = base
+        for log in self.held_logs:
+            log.seconds = log.decode_seconds(base)
+        raw_seconds = [log.decode_seconds(base) for log in self.log_lines]
+        for log, seconds in zip(self.log_lines, raw_seconds):
+            log.seconds = seconds - self.offset
+        if self.raw_seconds is not None:
+            self.raw_seconds = raw_seconds
+
     def correct(self, offset):
-        for log in self.log_lines:
-            log.seconds -= offset
+        # NOTE: the offset replaces the previous one, so that the offsets
+        # solved again in follow mode are not accumulated. Logs appended
+        # later in follow mode are corrected on reading.
+        if offset == self.offset:
+            return
+        if self.raw_seconds is None:
+            self.raw_seconds = [log.seconds for log in self.log_lines]
+        self.offset = offset
+        for log, seconds in zip(self.log_lines, self.raw_seconds):
+            log.seconds = seconds - offset
 
     def correct_seconds(self):
         # deprecated
@@ -244,23 +614,24 @@ class LogFile(object):
         for log in self.log_lines:
             log.seconds += offset
 
-    def apply_relation(self, relation, relation_name):
-        mismatch_errors = set()
-        for line in self.log_lines:
-            ret = line.apply(relation, relation_name)
-            if ret is not True and len(ret) == 36:
-                mismatch_errors.add(ret)
-                # self.log_lines[i].correct = False
-        return mismatch_errors
+    def resolve(self, relation, relation_name, name_errors, mismatch_errors):
+        """ Resolve the relations of lines and categorize them in one pass.
 
-    def catg_logs(self, name_errors, mismatch_errors):
+        The unresolved ids are added to mismatch_errors. All the lines of
+        such an id are unresolved, because any line with both id and name
+        would have indexed it.
+        """
+        logs_by_ins = self.logs_by_ins
+        errors = self.errors
         for log in self.log_lines:
-            if log.correct and log.instance_name not in name_errors \
-                    and log.instance_id not in mismatch_errors:
-                    # and log.instance_name not in mismatch_errors \
-                self.logs_by_ins[log.instance_name].append(log)
+            ret = log.apply(relation, relation_name)
+            if ret is not True and len(ret) == 36:
+                mismatch_errors.add(ret)
+                errors.append(log)
+            elif log.correct and log.instance_name not in name_errors:
+                logs_by_ins[log.instance_name].append(log)
             else:
-                self.errors.append(log)
+                errors.append(log)
 
     def pprint(self):
         print("name: %s" % self.name)
@@ -272,68 +643,292 @@ class LogFile(object):
         print("<<<<<\n")
 
 
+def _load_log_file(args):
+    name, file_dir = args
+    # NOTE: relations are replayed against the shared map by the collector.
+    return LogFile(name, file_dir, None)
+
+
+def _load_log_chunk(args):
+    name, file_dir, start, end = args
+    return LogFile(name, file_dir, None, chunk=(start, end))
+
+
+# NOTE: the api and conductor logs are much larger than the others, they
+# are split so that the workers are kept busy.
+MIN_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def _load_log_files(to_load, workers):
+    """ Load the files in order by a pool of workers, chunk by chunk. """
+    import multiprocessing
+
+    sizes = [path.getsize(file_dir) for _, file_dir in to_load]
+    chunk_size = max(MIN_CHUNK_SIZE, sum(sizes) // (workers * 2))
+    tasks = []
+    counts = []
+    for (name, file_dir), size in zip(to_load, sizes):
+        ranges = _split_chunks(file_dir, size, chunk_size)
+        counts.append(len(ranges))
+        tasks.extend((name, file_dir, start, end) for start, end in ranges)
+
+    pool = multiprocessing.Pool(min(workers, len(tasks)) or 1)
+    try:
+        chunks = pool.imap(_load_log_chunk, tasks)
+        for count in counts:
+            yield LogFile.join([next(chunks) for _ in range(count)])
+    finally:
+        pool.close()
+        pool.join()
+
+
+# NOTE: the pickles of Python 2 and 3 are not compatible.
+CACHE_NAME = ".parse_cache" if sys.version_info[0] == 2 else ".parse_cache3"
+# NOTE: increase it when the pickled LogFile or LogLine is changed.
+CACHE_VERSION = 7
+
+
+def _read_cache(cache_path):
+    """ Return the cached LogFiles by path, with their size and mtime. """
+    if not path.isfile(cache_path):
+        return {}
+    try:
+        with open(cache_path, 'rb') as reader:
+            version, entries = pickle.load(reader)
+    except Exception:
+        print("Ignore broken cache %s" % cache_path)
+        return {}
+    if version != CACHE_VERSION:
+        return {}
+    return entries
+
+
+def _write_cache(cache_path, entries):
+    tmp_path = cache_path + ".tmp"
+    try:
+        with open(tmp_path, 'wb') as writer:
+            pickle.dump((CACHE_VERSION, entries), writer,
+                        pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, cache_path)
+    except (IOError, OSError) as e:
+        print("Cannot write cache %s: %s" % (cache_path, e))
+
+
 class LogCollector(object):
-    def __init__(self, log_folder, driver_obj):
+    def __init__(self, log_folder, driver_obj, workers=1, follow=False,
+                 cache=False):
         self.log_files = []
 
         self.relation = {}
         self.service_host_dict = collections.defaultdict(dict)
+        # the epoch the seconds of all the log files are measured from
+        self.base = None
 
         # current_path = path.dirname(os.path.realpath(__file__))
         current_path = os.getcwd()
-        log_folder = path.join(current_path, log_folder)
+        self.log_folder = path.join(current_path, log_folder)
+        self.driver_obj = driver_obj
 
-        for f in os.listdir(log_folder):
-            file_dir = path.join(log_folder, f)
+        # follow mode
+        self.following = follow
+        self.followed_files = []
+        self.pending_logs = collections.OrderedDict()
+        self.relation_name = {}
+        self.name_errors = set()
+
+        if follow:
+            return
+
+        to_load = list(self._scan())
+        if cache:
+            for f in self._load_cached(to_load, workers):
+                self._apply_relation(f)
+                self._add_file(f, driver_obj)
+        elif workers > 1:
+            for f in _load_log_files(to_load, workers):
+                self._apply_relation(f)
+                self._add_file(f, driver_obj)
+        else:
+            for args in to_load:
+                f = _load_log_file(args)
+                self._apply_relation(f)
+                self._add_file(f, driver_obj)
+
+        if driver_obj.SERVICES != set(self.service_host_dict.keys()):
+            raise RuntimeError("Incompatible log files, expected %s, but %s."
+                               % (driver_obj.SERVICES,
+                                  self.service_host_dict.keys()))
+
+    def _scan(self):
+        names = os.listdir(self.log_folder)
+        suffix = bench_format.EVENTS_SUFFIX
+        sinks = set(f[:-len(suffix)] for f in names if f.endswith(suffix))
+        for f in names:
+            file_dir = path.join(self.log_folder, f)
             if not path.isfile(file_dir):
                 continue
-            if not f.endswith(".log"):
+            if not f.endswith(".log") and not f.endswith(suffix):
                 continue
             if f.startswith("out"):
                 continue
             if not f.startswith("BENCH"):
                 continue
-            f = LogFile(f, file_dir, self.relation)
-            if driver_obj.check_service(f.service):
-                if f.host not in self.service_host_dict[f.service]:
-                    self.service_host_dict[f.service][f.host] = f
-                    self.log_files.append(f)
+            if f.endswith(".log") and f[:-len(".log")] in sinks:
+                # NOTE: the events of the service are in its event sink,
+                # its oslo.log file only has the report and hook errors.
+                continue
+            yield f, file_dir
+
+    def _load_cached(self, to_load, workers):
+        """ Load files from the cache, parse and cache the changed ones. """
+        cache_path = path.join(self.log_folder, CACHE_NAME)
+        entries = _read_cache(cache_path)
+
+        keys = {}
+        loaded = {}
+        missed = []
+        for name, file_dir in to_load:
+            stat = os.stat(file_dir)
+            keys[file_dir] = (stat.st_size, stat.st_mtime)
+            entry = entries.get(file_dir)
+            if entry is not None and entry[0] == keys[file_dir]:
+                loaded[file_dir] = entry[1]
+            else:
+                missed.append((name, file_dir))
+
+        if missed:
+            if workers > 1:
+                files = list(_load_log_files(missed, workers))
+            else:
+                files = [_load_log_file(args) for args in missed]
+            for (name, file_dir), f in zip(missed, files):
+                loaded[file_dir] = f
+
+        if missed or len(entries) != len(to_load):
+            # NOTE: write before relations are applied to the files
+            _write_cache(cache_path,
+                         dict((file_dir, (keys[file_dir], loaded[file_dir]))
+                              for _, file_dir in to_load))
+
+        return [loaded[file_dir] for _, file_dir in to_load]
+
+    def _apply_relation(self, f):
+        """ Replay relations of a loaded file, in the order of its lines. """
+        for i, lg in enumerate(f.log_lines):
+            if not lg.get_relation(self.relation):
+                print("Fail getting relation for line %s in file %s!"
+                      % (lg, f.name))
+                f.truncate(i)
+                return
+
+    def _add_file(self, f, driver_obj):
+        if driver_obj.check_service(f.service):
+            if f.host not in self.service_host_dict[f.service]:
+                self.service_host_dict[f.service][f.host] = f
+                self.log_files.append(f)
+                if self.base is None:
+                    self.base = f.base
                 else:
-                    raise RuntimeError(
-                        "There's already a log for service "
-                        "%s: %s, but there is another one: %s"
-                        % (f.service,
-                           self.service_host_dict[f.service][f.host].name,
-                           f.name))
+                    f.rebase(self.base)
             else:
-                if f.log_lines:
-                    raise RuntimeError("Unrecognized service %s for file %s" %
-                                       (f.service, f.name))
-        if driver_obj.SERVICES != set(self.service_host_dict.keys()):
-            raise RuntimeError("Incompatible log files, expected %s, but %s."
-                               % (driver_obj.SERVICES,
-                                  self.service_host_dict.keys()))
+                raise RuntimeError(
+                    "There's already a log for service "
+                    "%s: %s, but there is another one: %s"
+                    % (f.service,
+                       self.service_host_dict[f.service][f.host].name,
+                       f.name))
+        else:
+            if f.log_lines:
+                raise RuntimeError("Unrecognized service %s for file %s" %
+                                   (f.service, f.name))
 
     def process_logs(self):
         name_errors = set()
         mismatch_errors = set()
 
-        # check name duplication
+        # NOTE: ids are indexed while the files are loaded, index the names
+        # and check name duplication.
         relation_name = {}
         for rel in self.relation.values():
-            rel_record = relation_name.get(rel.instance_name, None)
-            if rel_record:
+            rel_record = relation_name.get(rel.instance_name)
+            if rel_record is not None:
                 print("Warn! relation has duplicated name! %s, %s"
                       % (rel_record.get_line(), rel.get_line()))
                 name_errors.add(rel.instance_name)
             relation_name[rel.instance_name] = rel
 
-        # apply relations
         for lf in self.log_files:
-            mismatch_errors = mismatch_errors.union(lf.apply_relation(self.relation,
-                                                                      relation_name))
+            lf.resolve(self.relation, relation_name,
+                       name_errors, mismatch_errors)
+
+        return name_errors, mismatch_errors
+
+    def release_logs(self):
+        """ Drop the resolved logs from the collector, return them by file.
 
+        The logs are unlinked from each other and from the relations, so
+        that a log is freed once the caller drops it, e.g. in stream mode.
+        """
+        self.relation.clear()
+        ret = []
         for lf in self.log_files:
-            lf.catg_logs(name_errors, mismatch_errors)
+            for log in lf.log_lines:
+                log.prv = None
+                log.nxt = None
+            ret.append(lf.log_lines)
+            lf.log_lines = []
+            lf.raw_seconds = None
+            lf.logs_by_ins.clear()
+            lf.errors = []
+        return ret
+
+    def follow(self):
+        """ Read the appended logs, return those with resolved relations.
+
+        A log is held back, together with the following logs of the same
+        file, until its instance id and name can both be resolved.
+        """
+        assert self.following
+        names = set(f.name for f in self.followed_files)
+        for name, file_dir in self._scan():
+            if name not in names:
+                f = LogFile(name, file_dir, self.relation, follow=True)
+                self.followed_files.append(f)
+                self.pending_logs[f] = collections.deque()
+
+        for f in self.followed_files:
+            new_logs = f.follow(self.relation)
+            if not new_logs:
+                continue
+            if f not in self.log_files:
+                self._add_file(f, self.driver_obj)
+            for lg in new_logs:
+                if lg.instance_id != "?" and lg.instance_name != "?":
+                    rel = self.relation[lg.instance_id]
+                    rel_record = self.relation_name.get(rel.instance_name)
+                    if rel_record is None:
+                        self.relation_name[rel.instance_name] = rel
+                    elif rel_record is not rel:
+                        print("Warn! relation has duplicated name! %s, %s"
+                              % (rel_record.get_line(), rel.get_line()))
+                        self.name_errors.add(rel.instance_name)
+            self.pending_logs[f].extend(new_logs)
+
+        resolved = []
+        for pending in self.pending_logs.values():
+            while pending:
+                lg = pending[0]
+                if lg.instance_id == "?" and lg.instance_name == "?" \
+                        and "finish_db" in lg.action and lg.nxt is None:
+                    break
+                ret = lg.apply(self.relation, self.relation_name)
+                if ret is not True and len(ret) == 36:
+                    break
+                pending.popleft()
+                resolved.append(lg)
+        return resolved
 
-        return name_errors, mismatch_errors
+    @property
+    def has_pending(self):
+        return any(self.pending_logs.values()) \
+            or any(f.held_logs for f in self.followed_files)
@@ -16,10 +16,12 @@ from __future__ import print_function
 
 import argparse
 import collections
+import heapq
 import sys
+import time
 
-from log_parser import LogCollector
 from openstack_bench import bench_drivers
+from openstack_bench.log_parser.log_parser import LogCollector
 
 
 DIAGRAMS = collections.namedtuple("Diagrams",
@@ -238,9 +240,9 @@ class RequestStateMachine(object):
             if log.service == "api":
                 ps = pace
                 while ps:
-		    if ps.edge.diagram == self.graph.diagrams.api:
-			ps.more.append(log)
-			break
+                    if ps.edge.diagram == self.graph.diagrams.api:
+                        ps.more.append(log)
+                        break
                     ps = ps.bfo
                 if not ps:
                     raise RuntimeError("cannot place more")
@@ -674,7 +676,7 @@ class RequestStateMachinesParser(object):
             else:
                 raise RuntimeError("unrecognized state: %s" % stm.state)
 
-        start_time = sys.maxint
+        start_time = float("inf")
         end_time = 0
         for stm in self._available_stms:
             start_time = min(start_time, stm.paces[1].log.seconds)
@@ -1168,17 +1170,23 @@ def main():
                     active_computes)
 
 
-from state_graph import MasterGraph
-from statistics import Engine
-from statistics import Report
-import parser_engine
+from openstack_bench.log_parser import parser_engine
+from openstack_bench.log_parser.state_graph import MasterGraph
+from openstack_bench.log_parser.statistics import Engine
+from openstack_bench.log_parser.statistics import Report
+from openstack_bench.log_parser.statistics import StreamEngine
 
 
 def main1():
     parser = argparse.ArgumentParser()
     parser.add_argument('folder',
-                        default=".",
-                        help="The logs are in that folder.")
+                        nargs="+",
+                        help="The logs are in those folders, each of them "
+                             "is reported in turn.")
+    parser.add_argument('--driver',
+                        choices=bench_drivers.get_driver_names(),
+                        help="The bench driver of the logs, instead of the "
+                             "one configured in bench.conf.")
     parser.add_argument('--brief',
                         action="store_true",
                         help="Supress verbose error report.")
@@ -1186,12 +1194,48 @@ def main1():
                         help="Write a row into the CSV file for the headers.")
     parser.add_argument('--outfile',
                         help="The output file of report.")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of processes to load log files and "
+                             "to build nested instances, the latter are "
+                             "limited by the available CPUs.")
+    parser.add_argument('--no-cache',
+                        action="store_true",
+                        help="Don't use or write the parsed log cache in "
+                             "the log folder.")
+    parser.add_argument('--follow',
+                        action="store_true",
+                        help="Follow the growing logs and refresh the brief "
+                             "report until all requests are ended.")
+    parser.add_argument('--interval', type=float, default=2,
+                        help="Seconds between refreshes in follow mode.")
+    parser.add_argument('--stream',
+                        action="store_true",
+                        help="Aggregate the statistics of requests once they "
+                             "are parsed, instead of keeping them all.")
     args = parser.parse_args()
+    if args.follow and len(args.folder) > 1:
+        parser.error("--follow accepts only one folder")
+
+    # NOTE: oslo.config is imported only to read the driver from bench.conf.
+    if args.driver:
+        driver_obj = bench_drivers.init_driver(args.driver)
+    else:
+        driver_obj = bench_drivers.from_config()
+
+    if args.follow:
+        args.folder = args.folder[0]
+        follow(args, driver_obj)
+        return
+
+    for i, folder in enumerate(args.folder):
+        parse_folder(args, folder, driver_obj,
+                     args.csv_print_header and i == 0)
 
-    driver_obj = bench_drivers.from_config()
 
+def parse_folder(args, folder, driver_obj, csv_print_header):
     # build files
-    log_collector = LogCollector(args.folder, driver_obj)
+    log_collector = LogCollector(folder, driver_obj, args.workers,
+                                 cache=not args.no_cache)
 
     # build logs
     name_errors, mismatch_errors = log_collector.process_logs()
@@ -1205,19 +1249,89 @@ def main1():
     # build graph
     master_graph = MasterGraph.build_from_driver(driver_obj)
 
-    # build states
-    engine = parser_engine.ParserEngine(master_graph, log_collector)
-    instances = engine.parse()
+    if args.stream:
+        s_engine = stream(log_collector, master_graph, driver_obj)
+    else:
+        # build states
+        engine = parser_engine.ParserEngine(master_graph, log_collector)
+        instances = engine.parse(args.workers)
 
-    # for ins in instances.itervalues():
-    #     print(ins)
+        # for ins in instances.values():
+        #     print(ins)
 
-    # build statistics
-    s_engine = Engine(master_graph, instances, log_collector)
+        # build statistics
+        s_engine = Engine(master_graph, instances, log_collector)
     if args.brief:
-        s_engine.report(args.folder)
+        s_engine.report(folder)
     else:
-        report = Report(args.folder)
-        report.set_outfile(args.outfile, args.csv_print_header)
+        report = Report(folder)
+        report.set_outfile(args.outfile, csv_print_header)
         driver_obj.build_statistics(s_engine, report)
         report.export()
+
+
+def stream(log_collector, master_graph, driver_obj, batch=1000):
+    """ Parse the logs in time order and aggregate the ended requests.
+
+    The logs are released from log_collector, and a log is dropped once
+    its request is aggregated.
+    """
+    engine = parser_engine.ParserEngine(master_graph, log_collector)
+    s_engine = StreamEngine(master_graph,
+                            driver_obj.interval_queries(master_graph))
+
+    def file_logs(i, logs):
+        logs = collections.deque(logs)
+        j = 0
+        while logs:
+            log = logs.popleft()
+            yield log.seconds, i, j, log
+            j += 1
+
+    merged = heapq.merge(*[file_logs(i, logs) for i, logs
+                           in enumerate(log_collector.release_logs())])
+    logs = []
+    for item in merged:
+        logs.append(item[3])
+        if len(logs) == batch:
+            for instance in engine.feed(logs):
+                s_engine.add(instance)
+            logs = []
+    for instance in engine.feed(logs):
+        s_engine.add(instance)
+    for instance in engine.close():
+        s_engine.add(instance)
+
+    s_engine.finish()
+    return s_engine
+
+
+def follow(args, driver_obj):
+    log_collector = LogCollector(args.folder, driver_obj, follow=True)
+    master_graph = MasterGraph.build_from_driver(driver_obj)
+    engine = parser_engine.ParserEngine(master_graph, log_collector)
+
+    while True:
+        logs = log_collector.follow()
+        instances = engine.follow(logs)
+
+        if sys.stdout.isatty():
+            # clear the screen like watch
+            sys.stdout.write("\033[2J\033[H")
+        print("Every %.1fs: %s, %d new logs"
+              % (args.interval, time.strftime("%c"), len(logs)))
+        if log_collector.name_errors:
+            print("duplicated instance names: %s"
+                  % len(log_collector.name_errors))
+        if instances:
+            s_engine = Engine(master_graph, instances, log_collector)
+            s_engine.report(args.folder)
+        sys.stdout.flush()
+
+        # NOTE: wait for a quiet round so that the logs written during the
+        # last read are also included.
+        if not logs and instances \
+                and not log_collector.has_pending \
+                and all(ins.is_end for ins in instances.values()):
+            break
+        time.sleep(args.interval)
@@ -1,53 +1,133 @@
+from __future__ import print_function
+
 from collections import defaultdict
+from collections import deque
+import heapq
+import multiprocessing
+import os
 
-from state_machine import LeafInstance
-from state_machine import NestedInstance
-from state_machine import ParseError
+from openstack_bench.log_parser.state_machine import LeafInstance
+from openstack_bench.log_parser.state_machine import NestedInstance
+from openstack_bench.log_parser.state_machine import NestedPace
+from openstack_bench.log_parser.state_machine import ParseError
 
 
 class EngineHelper(object):
     def __init__(self, ident):
         self.ident = ident
-        self.instances_by_service_host = \
-            defaultdict(lambda: defaultdict(list))
-        self.instances_by_graph_host = \
-            defaultdict(lambda: defaultdict(list))
-        self.instances_by_graph = defaultdict(list)
         self.instance_set = set()
+        # in the order of adding
+        self.instances = []
 
-    def iter_by_sh(self, service, host):
-        for ins in self.instances_by_service_host[service][host]:
-            if ins._available:
-                yield ins
+        # NOTE: a log goes to the first added leaf instance accepting it,
+        # which is either waiting on a node with an accepting edge, or
+        # hasn't got the accepting ignored edge of its graph.
+        # heaps of (index, ins) by service, host and the waiting node
+        self.open_instances = {}
+        # queues of instances by host and the ignored edge
+        self.ignoring_instances = {}
 
-    def iter_by_graph(self, graph, host):
-        if host is None:
-            for ins in self.instances_by_graph[graph]:
-                if ins._available:
-                    yield ins
-        else:
-            for ins in self.instances_by_graph_host[graph][host]:
-                if ins._available:
-                    yield ins
+        # NOTE: nesting pops the leaf instance with the earliest sort_key
+        # from its start node, graph and host.
+        # queues of (sort_key, index, ins) by start node, graph and host,
+        # or by start node and graph if the host is None
+        self.nesting_queues = {}
+
+    def route(self, log, table, found):
+        """ Pop the first leaf instance to accept log from the index. """
+        best = None
+        best_heap = None
+        for node in table.nodes_accepting(found):
+            heap = self.open_instances.get((log.service, log.host, node))
+            if heap and (best is None or heap[0][0] < best._index):
+                best = heap[0][1]
+                best_heap = heap
+        best_queue = None
+        for graph in table.ignoring_graphs.get(log.service, ()):
+            edge = table.decide_ignored_edge(graph, found)
+            if edge is None:
+                continue
+            queue = self.ignoring_instances.get((log.host, edge))
+            if queue and (best is None or queue[0]._index < best._index):
+                best = queue[0]
+                best_queue = queue
+        if best_queue is not None:
+            best_queue.popleft()
+        elif best_heap is not None:
+            heapq.heappop(best_heap)
+        return best
+
+    def wait(self, ins):
+        """ Index the leaf instance by the node it is waiting on. """
+        if not ins.is_end:
+            key = (ins.service, ins.host, ins.to_node.index)
+            heap = self.open_instances.get(key)
+            if heap is None:
+                heap = self.open_instances[key] = []
+            heapq.heappush(heap, (ins._index, ins))
+
+    def pop_next(self, nodes, graphs, host):
+        """ Return the first leaf instance starting from nodes.
+
+        The graphs are tried in order, the earliest instance of the first
+        graph with any is returned. Removed instances are skipped and
+        dropped from the queue heads.
+        """
+        for graph in graphs:
+            best = None
+            for node in nodes:
+                queue = self.nesting_queues.get((node, graph, host))
+                if not queue:
+                    continue
+                while queue and not queue[0][2]._available:
+                    queue.popleft()
+                if queue and (best is None or queue[0] < best):
+                    best = queue[0]
+            if best is not None:
+                return best[2]
+        return None
 
     def add(self, ins):
         assert ins.ident == self.ident
         assert isinstance(ins, LeafInstance)
         ins._available = True
-        self.instances_by_service_host[ins.service][ins.host].append(ins)
-        self.instances_by_graph_host[ins.graph][ins.host].append(ins)
-        self.instances_by_graph[ins.graph].append(ins)
+        ins._index = len(self.instances)
+        self.instances.append(ins)
+        self.wait(ins)
+        for edge in ins.table.ignored_edges[ins.graph.index]:
+            key = (ins.host, edge)
+            queue = self.ignoring_instances.get(key)
+            if queue is None:
+                queue = self.ignoring_instances[key] = deque()
+            queue.append(ins)
         self.instance_set.add(ins)
 
     def sort(self):
-        for instances in self.instances_by_graph.itervalues():
-            instances.sort(key=lambda ins: ins.sort_key)
+        """ Build the nesting queues of the available leaf instances. """
+        queues = defaultdict(list)
+        for ins in self.instances:
+            if ins._available:
+                item = (ins.sort_key, ins._index, ins)
+                node = ins.from_node.index
+                queues[(node, ins.graph, ins.host)].append(item)
+                queues[(node, ins.graph, None)].append(item)
+        self.nesting_queues = {}
+        for key, items in queues.items():
+            items.sort()
+            self.nesting_queues[key] = deque(items)
 
     def remove(self, ins):
         assert ins in self.instance_set
         ins._available = False
         self.instance_set.remove(ins)
 
+    def reset(self):
+        """ Make all the instances available to be nested again. """
+        for ins in self.instances:
+            ins.disconnect()
+            ins._available = True
+            self.instance_set.add(ins)
+
     def __bool__(self):
         return bool(self.instance_set)
     __nonzero__ = __bool__
@@ -58,97 +138,298 @@ class ParserEngine(object):
         self.graph = graph
         self.log_collector = log_collector
 
-    def parse(self):
+        # follow and stream modes
+        self.helpers_by_ident = {}
+        self.instances = {}
+        self.dropped_logs = 0
+
+    def _parse_log(self, helpers_by_ident, log):
+        ident = log.ident
+        assert ident is not None
+
+        helper = helpers_by_ident.get(ident)
+        if helper is None:
+            helper = EngineHelper(ident)
+            helpers_by_ident[ident] = helper
+
+        table = self.graph.table
+        found = self.graph.match(log)
+        ins = helper.route(log, table, found)
+        if ins is not None:
+            to_pace = ins.to_pace
+            if not ins.confirm(log):
+                raise RuntimeError("Unaccepted logline: %s by %r"
+                                   % (log, ins))
+            # NOTE: route popped the instance from its node if it takes an
+            # edge, which may be a self-loop, but not if the log is of an
+            # ignored edge.
+            if ins.to_pace is not to_pace:
+                helper.wait(ins)
+        else:
+            graph = self.graph.decide_subgraph(log)
+            if not graph:
+                raise RuntimeError(
+                    "Unrecognized logline: %s" % log)
+            else:
+                ins = LeafInstance(graph, log.ident, log.host)
+
+                if not ins.confirm(log):
+                    raise RuntimeError(
+                        "Unrecognized init_log:%s" % log)
+
+                helper.add(ins)
+
+    def _nest(self, instance, helper):
+        """ Nest the leaf instances of helper into instance in time order.
+
+        Return False if it cannot find the next leaf instance.
+        """
+        table = self.graph.table
+        while not instance.is_end:
+            if instance.to_pace is None:
+                nodes = table.start_nodes[0]
+                graphs = table.start_graphs
+                host = None
+            else:
+                node = instance.to_node.index
+                nodes = (node,)
+                graphs = table.node_graphs[node]
+                # NOTE: the host assumed by the last pace, which is
+                # required by NestedPace.confirm_pace. The assume_host of
+                # the nested instance is None until it is ended.
+                host = instance.to_pace.assume_host
+            if not graphs:
+                break
+
+            ins = helper.pop_next(nodes, graphs, host)
+            if ins is None:
+                return False
+            if not instance.confirm(ins):
+                raise RuntimeError("Unaccepted instance %r by %r"
+                                   % (ins, instance))
+            helper.remove(ins)
+        return True
+
+    def _build_nested(self, ident, helper, verbose=True):
+        """ Build the nested instance of ident. """
+        instance = NestedInstance(self.graph, ident)
+
+        try:
+            found = self._nest(instance, helper)
+            if not found:
+                instance.fail_message = "%r cannot find next LeafInstance!" \
+                                        % instance
+        except ParseError as e:
+            instance.fail_message = str(e)
+
+        if instance.fail_message:
+            pass
+        elif helper:
+            instance.fail_message = "%r has unexpected instances!" \
+                                    % instance
+        elif instance.is_end is False:
+            instance.fail_message = "%r is not ended!" % instance
+
+        if instance.is_failed and verbose:
+            print("PARSE FAIL >>>>>>>>>>>>>>>>>>>")
+            print("Fail message")
+            print("------------")
+            print(instance.fail_message)
+            print("")
+            print("Parsed instance")
+            print("---------------")
+            print(instance)
+            if helper:
+                print("Unexpected instances")
+                print("--------------------")
+                for ins in helper.instances:
+                    if ins in helper.instance_set:
+                        print("\n%s" % ins)
+
+        return instance
+
+    def _link_nested(self, ident, helper, indexes):
+        """ Link the nested instance of ident from a worker's recipe.
+
+        The indexes are of the leaf instances nested by a worker without
+        failure, so they are linked as they are without confirming them
+        again, which would cost as much as the search.
+        """
+        instance = NestedInstance(self.graph, ident)
+        p = None
+        for index in indexes:
+            p = NestedPace(helper.instances[index], p)
+            if instance.from_pace is None:
+                instance.from_pace = p
+        instance.to_pace = p
+        if not instance.is_end:
+            raise RuntimeError("Unended instance %r by the recipe %r"
+                               % (instance, indexes))
+        return instance
+
+    def parse(self, workers=1):
         helpers_by_ident = {}
 
         # step 1: build leaf instances
+        # NOTE: sorted to be independent of the order of hashes.
         logs_by_service_host = self.log_collector.service_host_dict
-        for service, logs_by_host in logs_by_service_host.iteritems():
-            for host, log_file in logs_by_host.iteritems():
+        for service, logs_by_host in sorted(logs_by_service_host.items()):
+            for host, log_file in sorted(logs_by_host.items()):
                 for log in log_file.log_lines:
-                    ident = log.ident
-                    assert ident is not None
                     assert service == log.service
                     assert host == log.host
+                    self._parse_log(helpers_by_ident, log)
 
-                    helper = helpers_by_ident.get(ident)
-                    if not helper:
-                        helper = EngineHelper(ident)
-                        helpers_by_ident[ident] = helper
+        for helper in helpers_by_ident.values():
+            helper.sort()
 
-                    for ins in helper.iter_by_sh(service, host):
-                        if ins.confirm(log):
-                            break
-                    else:
-                        graph = self.graph.decide_subgraph(log)
-                        if not graph:
-                            raise RuntimeError(
-                                "Unrecognized logline: %s" % log)
-                        else:
-                            ins = LeafInstance(graph, log.ident, log.host)
+        # step 2: build nested instances
+        instances = {}
+        recipes = {}
+        # NOTE: the pool cannot pay off without another CPU to run on.
+        workers = min(workers, _available_cpus())
+        if workers > 1 and len(helpers_by_ident) > 1:
+            recipes = self._search_parallel(helpers_by_ident, workers)
+        # NOTE: failures are printed in the order of idents, they are built
+        # again in the parent to print the diagnostics.
+        for ident in sorted(helpers_by_ident):
+            helper = helpers_by_ident[ident]
+            indexes = recipes.get(ident)
+            if indexes is None:
+                instances[ident] = self._build_nested(ident, helper)
+            else:
+                instances[ident] = self._link_nested(ident, helper, indexes)
 
-                            if not ins.confirm(log):
-                                raise RuntimeError(
-                                    "Unrecognized init_log:%s" % log)
+        return instances
 
-                            helper.add(ins)
+    def _search_parallel(self, helpers_by_ident, workers):
+        """ Search the nested leaf instances of disjoint idents in workers.
 
-        for helper in helpers_by_ident.values():
+        The workers are forked with the leaf instances of step 1, they only
+        return the recipes to be linked by the parent process, so that the
+        instances are built upon the objects of the parent. The recipe of a
+        failed instance is None.
+        """
+        global _forked
+        idents = list(helpers_by_ident)
+        shards = [idents[i::workers * 4] for i in range(workers * 4)]
+        _forked = (self, helpers_by_ident)
+        # NOTE: the workers must be forked, which isn't the default of
+        # every platform in Python 3.
+        if hasattr(multiprocessing, "get_context"):
+            pool = multiprocessing.get_context("fork").Pool(
+                min(workers, len(idents)))
+        else:
+            pool = multiprocessing.Pool(min(workers, len(idents)))
+        try:
+            recipes = {}
+            for shard in pool.imap_unordered(_search_shard, shards):
+                recipes.update(shard)
+            return recipes
+        finally:
+            pool.close()
+            pool.join()
+            _forked = None
+
+    def follow(self, logs):
+        """ Parse logs in arrival order, rebuild the touched instances.
+
+        The logs of the same service and host must arrive in file order.
+        Nested instances of the identities touched by the logs are rebuilt
+        from their leaf instances, the others are kept as they are.
+        """
+        touched = set(log.ident for log in logs)
+        for ident in touched:
+            helper = self.helpers_by_ident.get(ident)
+            if helper is not None:
+                helper.reset()
+
+        for log in logs:
+            self._parse_log(self.helpers_by_ident, log)
+
+        for ident in touched:
+            helper = self.helpers_by_ident[ident]
             helper.sort()
+            self.instances[ident] = self._build_nested(ident, helper,
+                                                       verbose=False)
+        return self.instances
 
-        class BreakIt(Exception):
-            pass
+    def feed(self, logs):
+        """ Parse logs in arrival order, return the newly ended instances.
 
-        # step 2: build nested instances
-        instances = {}
-        for ident, helper in helpers_by_ident.iteritems():
-            instance = NestedInstance(self.graph, ident)
-
-            try:
-                while True:
-                    graphs = instance.assume_graphs()
-                    if not graphs:
-                        break
-
-                    try:
-                        for graph in graphs:
-                            host = instance.assume_host
-                            for ins in helper.iter_by_graph(graph, host):
-                                if instance.confirm(ins):
-                                    helper.remove(ins)
-                                    raise BreakIt()
-                    except BreakIt:
-                        pass
-                    else:
-                        instance.fail_message = "%r cannot find next LeafInstance!" \
-                                                % instance
-                        break
-            except ParseError as e:
-                instance.fail_message = e.message
-
-            if instance.fail_message:
-                pass
-            elif helper:
-                instance.fail_message = "%r has unexpected instances!" \
-                                        % instance
-            elif instance.is_end is False:
-                instance.fail_message = "%r is not ended!" % instance
-
-            if instance.is_failed:
-                print "PARSE FAIL >>>>>>>>>>>>>>>>>>>"
-                print "Fail message"
-                print "------------"
-                print instance.fail_message
-                print ""
-                print "Parsed instance"
-                print "---------------"
-                print instance
-                if helper:
-                    print("Unexpected instances")
-                    print "--------------------"
-                    for ins in helper.instance_set:
-                        print("\n%s" % ins)
+        The logs of the same service and host must arrive in file order,
+        with their relations resolved. A nested instance is returned once
+        it is ended without failure, and its state is evicted, so that the
+        memory is bounded by the requests in flight. The late logs of an
+        evicted identity, e.g. of the ignored edges, are counted in
+        dropped_logs if they cannot start a leaf instance.
 
-            instances[ident] = instance
+        NOTE: the touched identities are rebuilt per call, so feed logs in
+        batches rather than one by one.
+        """
+        helpers_by_ident = self.helpers_by_ident
+        touched = set()
+        accepted = []
+        for log in logs:
+            ident = log.ident
+            if ident not in helpers_by_ident and ident not in touched \
+                    and self.graph.decide_subgraph(log) is None:
+                self.dropped_logs += 1
+                continue
+            if ident not in touched:
+                touched.add(ident)
+                helper = helpers_by_ident.get(ident)
+                if helper is not None:
+                    helper.reset()
+            accepted.append(log)
 
+        for log in accepted:
+            self._parse_log(helpers_by_ident, log)
+
+        ended = []
+        for ident in sorted(touched):
+            helper = helpers_by_ident[ident]
+            helper.sort()
+            instance = self._build_nested(ident, helper, verbose=False)
+            if instance.is_end and not instance.is_failed:
+                del helpers_by_ident[ident]
+                ended.append(instance)
+        return ended
+
+    def close(self):
+        """ Build the instances left in stream mode, and evict them all.
+
+        They are either failed or not ended, the failures are printed.
+        """
+        instances = []
+        for ident in sorted(self.helpers_by_ident):
+            helper = self.helpers_by_ident[ident]
+            helper.reset()
+            helper.sort()
+            instances.append(self._build_nested(ident, helper))
+        self.helpers_by_ident.clear()
         return instances
+
+
+# NOTE: the engine and the helpers of step 1 are inherited by the forked
+# workers, instead of being pickled.
+_forked = None
+
+
+def _available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return multiprocessing.cpu_count()
+
+
+def _search_shard(idents):
+    engine, helpers_by_ident = _forked
+    recipes = {}
+    for ident in idents:
+        instance = engine._build_nested(ident, helpers_by_ident[ident],
+                                        verbose=False)
+        if instance.is_failed:
+            recipes[ident] = None
+        else:
+            recipes[ident] = [ins._index for ins in instance]
+    return recipes
@@ -1,4 +1,178 @@
-from orderedset import OrderedSet
+from __future__ import print_function
+
+import collections
+
+try:
+    from orderedset import OrderedSet
+except ImportError:
+    # NOTE: the C extension is not built for PyPy or Python 3, the edges of
+    # a node only need ordered adding and iteration.
+    class OrderedSet(object):
+        def __init__(self):
+            self._items = collections.OrderedDict()
+
+        def add(self, item):
+            self._items[item] = None
+
+        def __contains__(self, item):
+            return item in self._items
+
+        def __iter__(self):
+            return iter(self._items)
+
+        def __len__(self):
+            return len(self._items)
+
+
+class KeywordAutomaton(object):
+    """ Aho-Corasick automaton over keywords.
+
+    match() scans the text once and returns the bits of all the keywords
+    found in it.
+    """
+    def __init__(self, keywords_bits):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [0]
+        for keyword, bit in keywords_bits:
+            state = 0
+            for char in keyword:
+                nxt = self._goto[state].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(0)
+                    self._goto[state][char] = nxt
+                state = nxt
+            self._out[state] |= bit
+
+        # breadth-first, the fail state is always shallower
+        queue = collections.deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                self._out[nxt] |= self._out[self._fail[nxt]]
+
+    def match(self, text):
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        state = 0
+        found = out[0]
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            found |= out[state]
+        return found
+
+
+class TransitionTable(object):
+    """ The graph frozen into dense integer-indexed tables.
+
+    Nodes, edges and graphs are indexed by their position in nodes, edges
+    and graphs, the master graph is graph 0. The edges of a node are a
+    slice of the edge tables in the declared order. The object graph is
+    kept for printing and debugging.
+    """
+    def __init__(self, master):
+        self.nodes = sorted(master.tracked_nodes_by_id.values(),
+                            key=lambda node: node.id_)
+        self.graphs = [master] + list(master.graphs)
+        for i, node in enumerate(self.nodes):
+            node.index = i
+        for i, graph in enumerate(self.graphs):
+            graph.index = i
+
+        self.edges = []
+        self.edge_slices = []
+        self.edge_masks = []
+        self.edge_targets = []
+        self.edge_sources = []
+        for node in self.nodes:
+            start = len(self.edges)
+            for edge in node.edges:
+                edge.index = len(self.edges)
+                self.edges.append(edge)
+                self.edge_masks.append(edge.mask)
+                self.edge_targets.append(edge.node.index)
+                self.edge_sources.append(node.index)
+            self.edge_slices.append((start, len(self.edges)))
+
+        # NOTE: keep the iteration order of start nodes, the first match
+        # wins.
+        self.start_nodes = []
+        self.start_bits = []
+        self.end_bits = []
+        self.ignored_edges = []
+        for graph in self.graphs:
+            self.start_nodes.append(
+                tuple(node.index for node in graph.start_nodes))
+            self.start_bits.append(
+                sum(1 << node.index for node in graph.start_nodes))
+            self.end_bits.append(
+                sum(1 << node.index for node in graph.end_nodes))
+            self.ignored_edges.append(
+                tuple(edge for edge in getattr(graph, "ignored_edges", ())))
+
+        # the graphs to be nested next at a node, in the order of the sets
+        # of assume_graphs()
+        self.node_graphs = [tuple(set(edge.graph for edge in node.edges))
+                            for node in self.nodes]
+        self.start_graphs = tuple(set(edge.graph
+                                      for node in master.start_nodes
+                                      for edge in node.edges))
+
+        # the leaf graphs with ignored edges by service
+        self.ignoring_graphs = collections.defaultdict(list)
+        for graph in self.graphs[1:]:
+            if graph.ignored_edges:
+                self.ignoring_graphs[graph.service].append(graph.index)
+        self._nodes_accepting = {}
+
+    def decide_edge(self, node, found):
+        """ Return the first edge from node accepting the keyword bits. """
+        masks = self.edge_masks
+        start, end = self.edge_slices[node]
+        for edge in range(start, end):
+            if masks[edge] & found:
+                return edge
+        return -1
+
+    def nodes_accepting(self, found):
+        """ Return the nodes with an edge accepting the keyword bits. """
+        nodes = self._nodes_accepting.get(found)
+        if nodes is None:
+            nodes = tuple(node for node in range(len(self.nodes))
+                          if self.decide_edge(node, found) != -1)
+            self._nodes_accepting[found] = nodes
+        return nodes
+
+    def decide_start_edge(self, graph, found):
+        """ Return the first edge from the start nodes of graph. """
+        for node in self.start_nodes[graph]:
+            edge = self.decide_edge(node, found)
+            if edge != -1:
+                return edge
+        return -1
+
+    def decide_ignored_edge(self, graph, found):
+        for edge in self.ignored_edges[graph]:
+            if edge.mask & found:
+                return edge
+        return None
+
+    def is_start(self, graph, node):
+        return self.start_bits[graph] >> node & 1
+
+    def is_end(self, graph, node):
+        return self.end_bits[graph] >> node & 1
 
 
 # TODO: define transition, a transition is an Edge or a LeafGraph
@@ -14,6 +188,8 @@ class Node(object):
         self.master_graph = master_graph
         self.edges = OrderedSet()
         self._state = None
+        # assigned by TransitionTable
+        self.index = None
 
         # determine ownership
         self.determined = False
@@ -103,9 +279,11 @@ class Node(object):
                                % (self, self.graph.name, graph.name))
 
     def decide_edge(self, log):
-        for edge in self.edges:
-            if edge.accept(log):
-                return edge
+        found = self.master_graph.match(log)
+        if found:
+            for edge in self.edges:
+                if edge.mask & found:
+                    return edge
         return None
 
     def accept_edge(self, edge):
@@ -121,6 +299,10 @@ class Edge(object):
         self.keyword = keyword
 
         self._assume_host = None
+        # the bit of the keyword, assigned by MasterGraph.compile()
+        self.mask = 0
+        # assigned by TransitionTable
+        self.index = None
 
     @property
     def service(self):
@@ -134,7 +316,7 @@ class Edge(object):
             return "<!Edge#%s -> None, %s!>" % (self.graph.name, self.keyword)
 
     def accept(self, log):
-        return self.service == log.service and self.keyword in log.action
+        return bool(self.graph.master_graph.match(log) & self.mask)
 
     @property
     def f_assume_host(self):
@@ -153,6 +335,8 @@ class GraphBase(object):
         self.start_nodes = set()
         self.end_nodes = set()
         self.tracked_nodes = set()
+        # assigned by TransitionTable
+        self.index = None
 
     def determine_node(self, node):
         if node.determined:
@@ -208,6 +392,14 @@ class GraphBase(object):
                 return node, edge
         return None, None
 
+    @property
+    def start_mask(self):
+        mask = 0
+        for node in self.start_nodes:
+            for edge in node.edges:
+                mask |= edge.mask
+        return mask
+
     def accept(self, log):
         node, edge = self.decide_node_edge(log)
         if node is not None and edge is not None:
@@ -273,9 +465,11 @@ class LeafGraph(GraphBase):
         return ret_str
 
     def decide_edge_ignored(self, log):
-        for edge in self.ignored_edges:
-            if edge.accept(log):
-                return edge
+        found = self.master_graph.match(log)
+        if found:
+            for edge in self.ignored_edges:
+                if edge.mask & found:
+                    return edge
         return None
 
 
@@ -285,6 +479,12 @@ class MasterGraph(GraphBase):
         self.graphs = set()
         super(MasterGraph, self).__init__(name)
 
+        # compiled keyword matching and transitions
+        self._automatons = None
+        self._found = None
+        self._start_masks = None
+        self._table = None
+
     def create_graph(self, service_name):
         graph = LeafGraph(service_name, self)
         self.graphs.add(graph)
@@ -322,6 +522,7 @@ class MasterGraph(GraphBase):
         return node
 
     def build(self, from_, to, service_name, keyword):
+        self._automatons = None
         try:
             from_node = self.track_node(from_)
             if from_node.is_new:
@@ -386,17 +587,67 @@ class MasterGraph(GraphBase):
     @staticmethod
     def build_from_driver(driver):
         graph = driver.build_graph()
+        graph.compile()
 
-        print graph
+        print(graph)
         for sub in graph.graphs:
-            print sub
+            print(sub)
 
         return graph
 
-    def decide_subgraph(self, log):
+    def compile(self):
+        """ Compile the keywords and the transitions of the graph.
+
+        The edge keywords are compiled into an automaton per service. Each
+        distinct keyword of a service gets its own bit, so an edge is
+        accepted if its mask is in the bits matched from the log action.
+        """
+        bits = {}
+        keywords_by_service = collections.defaultdict(list)
         for sub in self.graphs:
-            if sub.accept(log):
-                return sub
+            for edge in list(sub.edges) + list(sub.ignored_edges):
+                key = (sub.service, edge.keyword)
+                if key not in bits:
+                    bits[key] = 1 << len(bits)
+                    keywords_by_service[sub.service].append(
+                        (edge.keyword, bits[key]))
+                edge.mask = bits[key]
+
+        self._automatons = dict(
+            (service, KeywordAutomaton(keywords))
+            for service, keywords in keywords_by_service.items())
+        self._found = collections.defaultdict(dict)
+        # NOTE: keep the iteration order of graphs, the first match wins.
+        self._start_masks = [(sub, sub.start_mask) for sub in self.graphs]
+        self._table = TransitionTable(self)
+
+    @property
+    def table(self):
+        if self._automatons is None:
+            self.compile()
+        return self._table
+
+    def match(self, log):
+        """ Return the bits of the keywords in the action of log. """
+        if self._automatons is None:
+            self.compile()
+        found_by_action = self._found[log.service]
+        found = found_by_action.get(log.action)
+        if found is None:
+            automaton = self._automatons.get(log.service)
+            if automaton is None:
+                found = 0
+            else:
+                found = automaton.match(log.action)
+            found_by_action[log.action] = found
+        return found
+
+    def decide_subgraph(self, log):
+        found = self.match(log)
+        if found:
+            for sub, mask in self._start_masks:
+                if mask & found:
+                    return sub
         return None
 
     @property
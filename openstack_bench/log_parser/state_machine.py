@@ -1,8 +1,8 @@
 import abc
 
-from state_graph import LeafGraph
-from state_graph import MasterGraph
-from state_graph import Node
+from openstack_bench.log_parser.state_graph import LeafGraph
+from openstack_bench.log_parser.state_graph import MasterGraph
+from openstack_bench.log_parser.state_graph import Node
 
 
 class ParseError(Exception):
@@ -88,15 +88,17 @@ class LeafPace(PaceBase):
 
     def confirm_pace(self, log):
         super(LeafPace, self).confirm_pace(log)
-        edge = self.to_node.decide_edge(log)
-        if edge:
-            p = LeafPace(log, self.to_node, edge, self)
+        master = self.to_node.master_graph
+        table = master.table
+        edge = table.decide_edge(self.to_node.index, master.match(log))
+        if edge != -1:
+            p = LeafPace(log, self.to_node, table.edges[edge], self)
             return p
         else:
             return None
 
     def __repr__(self):
-        return "<LeafPace (rid)%s (sec)%s %s>" % (self.log.request_id,
+        return "<LeafPace (rid)%s (sec)%r %s>" % (self.log.request_id,
                                                   self.log.seconds,
                                                   self.log.action)
 
@@ -134,7 +136,8 @@ class NestedPace(PaceBase):
         if host is not None and ins.host != host:
             return None
 
-        if self.to_node.accept_edge(ins.from_edge):
+        table = self.to_node.master_graph.table
+        if table.edge_sources[ins.from_edge.index] == self.to_node.index:
             p = NestedPace(ins, self)
             return p
         else:
@@ -186,7 +189,8 @@ class InstanceBase(object):
 
     @property
     def is_end(self):
-        if self.to_pace and self.to_pace.to_node in self.graph.end_nodes:
+        if self.to_pace and self.table.is_end(self.graph.index,
+                                              self.to_pace.to_node.index):
             return True
         else:
             return False
@@ -254,6 +258,7 @@ class LeafInstance(InstanceBase):
 
         self.host = host
         self.extra_logs = {}
+        self.table = graph.master_graph.table
 
     @property
     def from_edge(self):
@@ -274,28 +279,41 @@ class LeafInstance(InstanceBase):
     def connect(self, ins):
         self.to_pace.connect(ins.from_pace)
 
+    def disconnect(self):
+        """ Undo the connections made by nesting. """
+        if self.to_pace is not None:
+            self.to_pace.nxt = None
+        if self.from_pace is not None:
+            self.from_pace.bfo = None
+
     def confirm(self, log):
         assert self.host == log.host
 
         if self.ident != log.ident:
             return False
 
+        table = self.table
+        found = self.graph.master_graph.match(log)
         if not self.is_end:
             p = None
             if self.to_pace is None:
-                node, edge = self.graph.decide_node_edge(log)
-                if node and edge:
-                    p = LeafPace(log, node, edge, None)
+                edge = table.decide_start_edge(self.graph.index, found)
+                if edge != -1:
+                    node = table.nodes[table.edge_sources[edge]]
+                    p = LeafPace(log, node, table.edges[edge], None)
                     self.from_pace = p
             else:
-                p = self.to_pace.confirm_pace(log)
+                node = self.to_pace.to_node
+                edge = table.decide_edge(node.index, found)
+                if edge != -1:
+                    p = LeafPace(log, node, table.edges[edge], self.to_pace)
 
             if p:
                 self.to_pace = p
                 return True
 
         # extra edges handling
-        edge = self.graph.decide_edge_ignored(log)
+        edge = table.decide_ignored_edge(self.graph.index, found)
         if edge is not None:
             if edge not in self.extra_logs:
                 assert self.host == log.host
@@ -317,7 +335,7 @@ class LeafInstance(InstanceBase):
 
         if self.extra_logs:
             ret_str += "\nExtra_logs:"
-            for log in self.extra_logs.itervalues():
+            for log in self.extra_logs.values():
                 ret_str += "\n    %s" % log
 
         ret_str += "\n"
@@ -328,6 +346,7 @@ class NestedInstance(InstanceBase):
     def __init__(self, graph, ident):
         assert isinstance(graph, MasterGraph)
         super(NestedInstance, self).__init__(graph, ident)
+        self.table = graph.table
 
     @property
     def start_leaf_pace(self):
@@ -340,12 +359,10 @@ class NestedInstance(InstanceBase):
         if not self.is_end:
             p = None
             if self.to_pace is None:
-                # TODO self.graph.
-                for node in self.graph.start_nodes:
-                    if node.accept_edge(ins.from_edge):
-                        p = NestedPace(ins)
-                        self.from_pace = p
-                        break
+                table = self.table
+                if table.is_start(0, table.edge_sources[ins.from_edge.index]):
+                    p = NestedPace(ins)
+                    self.from_pace = p
             else:
                 p = self.to_pace.confirm_pace(ins)
 
@@ -1,8 +1,18 @@
+from __future__ import print_function
+
 from collections import defaultdict
+from collections import deque
+import math
 from numbers import Integral
 from numbers import Real
 
-from state_graph import MasterGraph
+from openstack_bench.log_parser.state_graph import MasterGraph
+from openstack_bench.utils.optional import import_numpy
+
+
+INF = float("inf")
+# NOTE: the finest resolution of the recorded timestamps, of the events.
+RESOLUTION = 1e-6
 
 
 class Interval(object):
@@ -17,48 +27,128 @@ class Interval(object):
         return ret_str
 
 
+def _as_list(values):
+    return values.tolist() if hasattr(values, "tolist") else values
+
+
 class Intervals(object):
-    def __init__(self, intervals):
-        assert isinstance(intervals, list)
-        self.intervals = intervals
-        self.intervals.sort(key=lambda interv: (interv.start, interv.end))
+    """ The intervals as sorted columns of starts, ends and durations.
+
+    The columns are NumPy arrays if NumPy is installed, otherwise lists.
+    The Interval objects are only created to print the intervals.
+    """
+    def __init__(self, starts=(), ends=()):
+        numpy = import_numpy()
+        if numpy is None:
+            pairs = sorted(zip(starts, ends))
+            self.starts = [start for start, _ in pairs]
+            self.ends = [end for _, end in pairs]
+            self.durations = [end - start for start, end in pairs]
+        else:
+            starts = numpy.asarray(starts, dtype=numpy.float64)
+            ends = numpy.asarray(ends, dtype=numpy.float64)
+            order = numpy.lexsort((ends, starts))
+            self.starts = starts[order]
+            self.ends = ends[order]
+            self.durations = self.ends - self.starts
         self._w_t = None
         self._ave = None
+        self._sorted = None
+
+    @property
+    def intervals(self):
+        return [Interval(start, end) for start, end
+                in zip(_as_list(self.starts), _as_list(self.ends))]
 
     def wall_time(self):
+        """ The length of the union of the intervals. """
         if self._w_t is None:
-            total = 0
-            start = None
-            end = None
-            for inte in self.intervals:
-                if start is None:
-                    start = inte.start
-                    end = inte.end
-                elif inte.start <= end:
-                    end = max(end, inte.end)
-                else:
-                    total += (end-start)
-                    start = inte.start
-                    end = inte.end
-            if start is not None:
+            numpy = import_numpy()
+            if not len(self):
+                self._w_t = 0
+            elif numpy is None:
+                total = 0
+                start = None
+                end = None
+                for inte_start, inte_end in zip(self.starts, self.ends):
+                    if start is None:
+                        start = inte_start
+                        end = inte_end
+                    elif inte_start <= end:
+                        end = max(end, inte_end)
+                    else:
+                        total += (end-start)
+                        start = inte_start
+                        end = inte_end
                 total += (end-start)
-            self._w_t = total
+                self._w_t = total
+            else:
+                # NOTE: an interval begins a new run of overlapped ones
+                # only if it starts after all the previous ones are ended.
+                reach = numpy.maximum.accumulate(self.ends)
+                begins = numpy.empty(len(self), dtype=bool)
+                begins[0] = True
+                numpy.greater(self.starts[1:], reach[:-1], out=begins[1:])
+                firsts = numpy.flatnonzero(begins)
+                lasts = numpy.append(firsts[1:] - 1, len(self) - 1)
+                self._w_t = float((reach[lasts] - self.starts[firsts]).sum())
         return self._w_t
 
     def average(self):
         if self._ave is None:
-            if not self.intervals:
+            if not len(self):
                 self._ave = 0
+            elif import_numpy() is None:
+                self._ave = sum(self.durations) / len(self)
             else:
-                self._ave = sum([interval.duration
-                                 for interval in self.intervals]) /\
-                    len(self.intervals)
+                self._ave = float(self.durations.mean())
         return self._ave
 
+    def _sorted_durations(self):
+        if self._sorted is None:
+            numpy = import_numpy()
+            if numpy is None:
+                self._sorted = sorted(self.durations)
+            else:
+                self._sorted = numpy.sort(self.durations)
+        return self._sorted
+
+    def minimum(self):
+        return float(self._sorted_durations()[0]) if len(self) else 0
+
+    def maximum(self):
+        return float(self._sorted_durations()[-1]) if len(self) else 0
+
+    def stddev(self):
+        """ The population standard deviation of the durations. """
+        if not len(self):
+            return 0
+        elif import_numpy() is None:
+            average = self.average()
+            return math.sqrt(sum((duration - average) ** 2
+                                 for duration in self.durations)
+                             / len(self))
+        else:
+            return float(self.durations.std())
+
+    def percentile(self, percent):
+        """ The duration at percent of 0 to 100, linearly interpolated. """
+        if not len(self):
+            return 0
+        durations = self._sorted_durations()
+        rank = (len(durations) - 1) * percent / 100.0
+        low = int(math.floor(rank))
+        high = min(low + 1, len(durations) - 1)
+        return float(durations[low]
+                     + (durations[high] - durations[low]) * (rank - low))
+
+    def histogram(self):
+        """ The LatencyHistogram of the durations. """
+        return LatencyHistogram.from_durations(self.durations)
+
     def x_y_incremental(self):
-        data0 = [(round(interval.start, 6), 1) for interval in self.intervals]
-        data0.extend([(round(interval.end, 6), -1)
-                      for interval in self.intervals])
+        data0 = [(round(start, 6), 1) for start in _as_list(self.starts)]
+        data0.extend([(round(end, 6), -1) for end in _as_list(self.ends)])
         data0.sort(key=lambda tup: tup[0])
 
         x_list = []
@@ -92,9 +182,7 @@ class Intervals(object):
         return x_list, y_list, start_x
 
     def x_y_lasts(self):
-        x_list = [interval.start for interval in self.intervals]
-        y_list = [interval.duration for interval in self.intervals]
-        return x_list, y_list
+        return _as_list(self.starts), _as_list(self.durations)
 
     def __str__(self):
         ret_str = "Intervals:"
@@ -103,7 +191,149 @@ class Intervals(object):
         return ret_str
 
     def __len__(self):
-        return len(self.intervals)
+        return len(self.starts)
+
+
+class LatencyHistogram(object):
+    """ The counts of durations in log-scaled buckets, like HdrHistogram.
+
+    A bucket covers the durations up to GROWTH times of the last one, so
+    the percentiles are at most 2% above the exact ones. The durations below
+    MIN_DURATION go to the first bucket. Histograms are merged by adding
+    the counts of buckets, so the histograms dumped into the CSV reports
+    of repeated runs can be loaded and combined.
+    """
+    MIN_DURATION = 0.000001
+    GROWTH = 1.02
+    VERSION = "h1"
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    @classmethod
+    def from_durations(cls, durations):
+        histogram = cls()
+        if not len(durations):
+            return histogram
+        numpy = import_numpy()
+        if numpy is None:
+            for duration in durations:
+                histogram.add(duration)
+            return histogram
+        durations = numpy.asarray(durations, dtype=numpy.float64)
+        indexes = numpy.ceil(
+            numpy.log(numpy.maximum(durations, cls.MIN_DURATION)
+                      / cls.MIN_DURATION) / math.log(cls.GROWTH))
+        indexes, counts = numpy.unique(indexes.astype(numpy.int64),
+                                       return_counts=True)
+        histogram.counts.update(zip(indexes.tolist(), counts.tolist()))
+        histogram.count = len(durations)
+        histogram.total = float(durations.sum())
+        histogram.min = float(durations.min())
+        histogram.max = float(durations.max())
+        return histogram
+
+    @classmethod
+    def _index(cls, duration):
+        if duration <= cls.MIN_DURATION:
+            return 0
+        return int(math.ceil(math.log(duration / cls.MIN_DURATION)
+                             / math.log(cls.GROWTH)))
+
+    @classmethod
+    def _upper(cls, index):
+        return cls.MIN_DURATION * cls.GROWTH ** index
+
+    def add(self, duration):
+        self.counts[self._index(duration)] += 1
+        self.count += 1
+        self.total += duration
+        if self.min is None or duration < self.min:
+            self.min = duration
+        if self.max is None or duration > self.max:
+            self.max = duration
+
+    def merge(self, histogram):
+        for index, count in histogram.counts.items():
+            self.counts[index] += count
+        self.count += histogram.count
+        self.total += histogram.total
+        if histogram.min is not None and \
+                (self.min is None or histogram.min < self.min):
+            self.min = histogram.min
+        if histogram.max is not None and \
+                (self.max is None or histogram.max > self.max):
+            self.max = histogram.max
+
+    def average(self):
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, percent):
+        """ The upper bound of the bucket at percent of 0 to 100. """
+        if not self.count:
+            return 0
+        rank = max(1, int(math.ceil(self.count * percent / 100.0)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                break
+        return min(max(self._upper(index), self.min), self.max)
+
+    def bins(self):
+        """ Yield the upper bound and count of the doubled ranges. """
+        merged = defaultdict(int)
+        for index, count in self.counts.items():
+            upper = self._upper(index)
+            merged[2 ** int(math.ceil(math.log(upper, 2) - 1e-9))] += count
+        for upper in sorted(merged):
+            yield upper, merged[upper]
+
+    def dumps(self):
+        """ The histogram as a line without commas, for the CSV reports. """
+        if not self.count:
+            return self.VERSION
+        fields = [self.VERSION, repr(self.min), repr(self.max),
+                  repr(self.total)]
+        fields.extend("%d:%d" % (index, self.counts[index])
+                      for index in sorted(self.counts))
+        return " ".join(fields)
+
+    @classmethod
+    def loads(cls, line):
+        fields = line.split()
+        if not fields or fields[0] != cls.VERSION:
+            raise RuntimeError("Unsupported histogram: %s" % line)
+        histogram = cls()
+        if len(fields) > 1:
+            histogram.min = float(fields[1])
+            histogram.max = float(fields[2])
+            histogram.total = float(fields[3])
+            for field in fields[4:]:
+                index, count = field.split(":")
+                histogram.counts[int(index)] = int(count)
+            histogram.count = sum(histogram.counts.values())
+        return histogram
+
+    def __str__(self):
+        if not self.count:
+            return "empty"
+        lines = ["count %d, p50 %.5f, p95 %.5f, p99 %.5f, max %.5f"
+                 % (self.count, self.percentile(50), self.percentile(95),
+                    self.percentile(99), self.max)]
+        peak = max(count for _, count in self.bins())
+        for upper, count in self.bins():
+            lines.append(("  <=%11.6f %7d %s"
+                          % (upper, count, "#" * int(40.0 * count / peak)))
+                         .rstrip())
+        return "\n".join(lines)
+
+    def __len__(self):
+        return self.count
 
 
 class Report(object):
@@ -119,6 +349,11 @@ class Report(object):
         self.contents.append((key, value))
         self.key_len = max(self.key_len, len(key))
 
+    def register_percentiles(self, key, intervals, percents=(50, 95, 99)):
+        for percent in percents:
+            self.register("%s p%s" % (key, percent),
+                          intervals.percentile(percent))
+
     def blank(self):
         self.contents.append(None)
 
@@ -135,25 +370,204 @@ class Report(object):
                 elif isinstance(content[1], Integral):
                     format_str = "{:<" + str(self.key_len + 2) + "}{:d}"
                     print(format_str.format(content[0]+":", content[1]))
+                elif isinstance(content[1], LatencyHistogram):
+                    format_str = "{:<" + str(self.key_len + 2) + "}{:s}"
+                    print(format_str.format(content[0]+":", "")
+                          + str(content[1]).replace("\n", "\n  "))
                 elif isinstance(content[1], Real):
                     format_str = "{:<" + str(self.key_len + 2) + "}{:7.5f}"
                     print(format_str.format(content[0]+":", content[1]))
                 else:
                     format_str = "{:<" + str(self.key_len + 2) + "}{:s}"
-                    print(format_str.format(content[0]+":", content[1]))
+                    print(format_str.format(content[0]+":", str(content[1])))
         else:
             outfile = open(self.outfile, "a+")
             if self.print_header:
                 header_fields = [content[0] for content in self.contents
                                  if content is not None]
                 outfile.write(",".join(header_fields) + '\n')
-            row_fields = [str(content[1]) for content in self.contents
+            row_fields = [content[1].dumps()
+                          if isinstance(content[1], LatencyHistogram)
+                          else str(content[1])
+                          for content in self.contents
                           if content is not None]
             outfile.write(",".join(row_fields) + '\n')
             outfile.flush()
             outfile.close()
 
 
+class IntervalsBuilder(object):
+    """ Collect the raw intervals by the hosts of their start and end.
+
+    The clock offsets of hosts are applied when the intervals are built,
+    so that the intervals can be collected before the offsets are solved.
+    """
+    def __init__(self):
+        self.by_hosts = defaultdict(list)
+
+    def add(self, start_host, start, end_host, end):
+        self.by_hosts[(start_host, end_host)].append((start, end))
+
+    def extend(self, builder):
+        for hosts, items in builder.by_hosts.items():
+            self.by_hosts[hosts].extend(items)
+
+    def build(self, offsets=None):
+        starts = []
+        ends = []
+        for (start_host, end_host), items in self.by_hosts.items():
+            start_offset = offsets.get(start_host, 0) if offsets else 0
+            end_offset = offsets.get(end_host, 0) if offsets else 0
+            if start_offset or end_offset:
+                starts.extend(start - start_offset for start, _ in items)
+                ends.extend(end - end_offset for _, end in items)
+            else:
+                starts.extend(start for start, _ in items)
+                ends.extend(end for _, end in items)
+        return Intervals(starts, ends)
+
+    def __len__(self):
+        return sum(len(items) for items in self.by_hosts.values())
+
+
+class QueryPlan(object):
+    """ The node targets of interval queries, compiled by node ids.
+
+    A target (from node, to node) has a slot to collect its intervals,
+    which is shared by the overlapped sets of targets. ends_at lists the
+    slots ended at a node id, by (slot, from node id, before cut), so all
+    the targets are evaluated in one walk of an instance. The plans are
+    compiled once by their targets and reused by the later queries.
+    """
+    _plans = {}
+
+    def __init__(self, targets, cut_targets):
+        self.pairs = []
+        ends_at = defaultdict(list)
+        slot_ids = {}
+
+        def compile_slots(target, before_cut):
+            slots = []
+            for pair in sorted(target):
+                if (pair, before_cut) not in slot_ids:
+                    slot = len(self.pairs)
+                    slot_ids[(pair, before_cut)] = slot
+                    self.pairs.append(pair)
+                    ends_at[pair[1]].append((slot, pair[0], before_cut))
+                slots.append(slot_ids[(pair, before_cut)])
+            return tuple(slots)
+
+        self.slots_by_target = dict(
+            (target, compile_slots(target, False)) for target in targets)
+        self.slots_by_cut_target = dict(
+            (target, compile_slots(target, True)) for target in cut_targets)
+        self.ends_at = dict((node_id, tuple(slots))
+                            for node_id, slots in ends_at.items())
+
+    @classmethod
+    def get(cls, targets, cut_targets):
+        key = (frozenset(targets), frozenset(cut_targets))
+        plan = cls._plans.get(key)
+        if plan is None:
+            plan = cls(targets, cut_targets)
+            cls._plans[key] = plan
+        return plan
+
+    def check(self, graph):
+        for pair in self.pairs:
+            for node_id in pair:
+                if node_id not in graph.tracked_nodes_by_id:
+                    raise RuntimeError("Node#%s cannot find in graph"
+                                       % node_id)
+
+
+class IntervalQuery(object):
+    """ Extract the intervals between node targets from instances. """
+    def __init__(self, graph, targets, cut_targets, cut_edge):
+        self.targets = targets
+        self.cut_targets = cut_targets
+        self.cut_edge = cut_edge
+
+        self.plan = QueryPlan.get(targets, cut_targets)
+        self.plan.check(graph)
+        # NOTE: a slot is a list of (start point, end point), the points
+        # are (seconds, host).
+        self.slots = [[] for _ in self.plan.pairs]
+        self.ret_cutted = IntervalsBuilder()
+        self.tracking = Tracking(max(graph.tracked_nodes_by_id) + 1)
+
+    @staticmethod
+    def make_key(targets, cut_targets, cut_edge):
+        return (tuple(targets), tuple(cut_targets), cut_edge)
+
+    @property
+    def key(self):
+        return self.make_key(self.targets, self.cut_targets, self.cut_edge)
+
+    def walk(self, instance):
+        ends_at = self.plan.ends_at
+        slots = self.slots
+        tracking = self.tracking
+        tracking.reset()
+        is_cut = False
+        cut = None
+        for p in instance.iterall():
+            edge = p.edge
+            from_node_id = p.from_node.id_
+            node_id = p.to_node.id_
+            # NOTE: the host is tracked to correct the interval later.
+            point = (p.log.seconds, p.log.host)
+            tracking.step(from_node_id, point, node_id)
+            if node_id in ends_at:
+                for slot, start_id, before_cut in ends_at[node_id]:
+                    if before_cut and is_cut:
+                        continue
+                    start = tracking[start_id]
+                    if start is not None:
+                        slots[slot].append((start, point))
+            if edge is self.cut_edge and is_cut is False:
+                is_cut = True
+                cut = point
+
+        if cut is not None:
+            self.ret_cutted.add(cut[1], cut[0],
+                                instance.to_pace.sub_instance.host,
+                                instance.to_seconds)
+
+    def _columns(self, slot, offsets):
+        items = self.slots[slot]
+        if offsets:
+            return ([start[0] - offsets.get(start[1], 0)
+                     for start, _ in items],
+                    [end[0] - offsets.get(end[1], 0) for _, end in items])
+        else:
+            return ([start[0] for start, _ in items],
+                    [end[0] for _, end in items])
+
+    def build(self, offsets=None):
+        columns = {}
+
+        def build_intervals(slots):
+            starts = []
+            ends = []
+            for slot in slots:
+                if slot not in columns:
+                    columns[slot] = self._columns(slot, offsets)
+                starts.extend(columns[slot][0])
+                ends.extend(columns[slot][1])
+            return Intervals(starts, ends)
+
+        intervals_dict = dict(
+            (target, build_intervals(slots))
+            for target, slots in self.plan.slots_by_target.items())
+        c_intervals_dict = dict(
+            (target, build_intervals(slots))
+            for target, slots in self.plan.slots_by_cut_target.items())
+        cutted_intervals = self.ret_cutted.build(offsets)
+
+        return intervals_dict, c_intervals_dict, cutted_intervals
+
+
 class Engine(object):
     def __init__(self, graph, instances, log_collector):
         assert isinstance(instances, dict)
@@ -162,162 +576,189 @@ class Engine(object):
         self.graph = graph
         self.available_instances = []
         self.error_instances = []
+        self.results = {}
 
+        if log_collector is not None:
+            # NOTE: the offsets are solved from the raw seconds in every
+            # round of the follow mode.
+            for log_file in log_collector.log_files:
+                log_file.correct(0)
         constraints = self.check()
         self.relax_constraints(constraints, log_collector)
         self.parse()
 
+    def _init_check(self):
+        self.total_requests = 0
+        self.error_requests = 0
+        self.requests_to_adjust = 0
+        self.points_to_adjust = set()
+
+    def _check(self, instance, constraints):
+        """ Check an instance and add its constraints if it is available. """
+        self.total_requests += 1
+        if instance.is_failed or instance.state in ["UNKNOWN", "-"]:
+            self.error_requests += 1
+            return False
+
+        last_ins = None
+        adjust = False
+        for leaf_ins in instance:
+            if last_ins:
+                constraints.add(last_ins.host, last_ins.to_seconds,
+                                leaf_ins.host, leaf_ins.from_seconds)
+                if last_ins.to_seconds > leaf_ins.from_seconds:
+                    self.points_to_adjust.add((last_ins.host, leaf_ins.host))
+                    if not adjust:
+                        adjust = True
+                        self.requests_to_adjust += 1
+            last_ins = leaf_ins
+        return True
+
     def check(self):
-        requests = 0
-        adjust_requests = 0
-        adjust_points = set()
+        self._init_check()
         constraints = Constraints()
 
-        for instance in self.instances.itervalues():
-            requests += 1
-            if instance.is_failed or instance.state in ["UNKNOWN", "-"]:
-                self.error_instances.append(instance)
-                continue
-            else:
+        for instance in self.instances.values():
+            if self._check(instance, constraints):
                 self.available_instances.append(instance)
-
-            last_ins = None
-            adjust = False
-            for leaf_ins in instance:
-                if last_ins:
-                    constraints.add(last_ins.host, last_ins.to_seconds,
-                                    leaf_ins.host, leaf_ins.from_seconds)
-                    if last_ins.to_seconds > leaf_ins.from_seconds:
-                        adjust_points.add((last_ins.host, leaf_ins.host))
-                        if not adjust:
-                            adjust = True
-                            adjust_requests += 1
-                last_ins = leaf_ins
-
-        self.total_requests = requests
-        self.requests_to_adjust = adjust_requests
-        self.points_to_adjust = adjust_points
+            else:
+                self.error_instances.append(instance)
         return constraints
 
     def relax_constraints(self, constraints, log_collector):
-        print "-"*20
+        """ Solve the clock offsets of hosts and return them.
+
+        The log files of log_collector are corrected if it is not None.
+        """
+        print("-"*20)
         print("\n >> CONSTRAINT REPORT:")
 
-        print "Violated requests: %s" % self.requests_to_adjust
-        print "Violated constraints:"
-        conp_list, host_dict = constraints.group_by_host()
+        print("Violated requests: %s" % self.requests_to_adjust)
+        print("Violated constraints:")
+        conp_list, _ = constraints.group_by_host()
         min_dist = None
+        # NOTE: the pairs of negative distance are infeasible cycles, they
+        # do not narrow the margin.
+        margin = None
         for conp in conp_list:
             if conp.violated:
-                print "    %s" % conp
+                print("    %s" % conp)
             dist = conp.distance
             if dist is not None:
                 if min_dist is None:
                     min_dist = dist
                 else:
                     min_dist = min(min_dist, dist)
-        print "Min distance: %.3f" % min_dist
+                if dist >= 0 and (margin is None or dist / 2 < margin):
+                    margin = dist / 2
+        if min_dist is None:
+            # NOTE: happens with partial logs in follow mode
+            print("Min distance: None, no adjustion")
+            print("")
+            print("-"*20)
+            return None
+        print("Min distance: %.3f" % min_dist)
 
-        c_engine = CausalEngine(host_dict, conp_list, min_dist/2)
-        c_engine.relax(conp_list[0].from_host)
+        solver = ClockSolver(conp_list, margin or 0)
+        offsets = solver.solve()
+        for cycle in solver.cycles:
+            print("Infeasible cycle: %s" % solver.cycle_str(cycle))
 
-        print "Adjustion result(%d):" % c_engine.counter
-        hosts = [host for host in c_engine.hosts.values()]
-        hosts.sort(key=lambda host: host.name)
-        for host in hosts:
-            if host.low != 0:
-                print "    %s" % host
+        print("Adjustion result(%d):" % solver.counter)
+        for host in sorted(offsets):
+            if offsets[host] != 0:
+                print("    %s" % solver.host_str(host))
 
-        print
-        print "-"*20
+        print("")
+        print("-"*20)
 
-        for log_file in log_collector.log_files:
-            name = log_file.host
-            log_file.correct(c_engine.hosts[name].high)
+        if log_collector is not None:
+            for log_file in log_collector.log_files:
+                log_file.correct(offsets.get(log_file.host, 0))
+        return offsets
 
-        # check again
-        """
-        print
-        constraints = self.check()
-        print "Violated requests: %s" % self.requests_to_adjust
-        print "Violated constraints:"
-        conp_list, host_dict = constraints.group_by_host()
-        min_dist = None
-        for conp in conp_list:
-            if conp.violated:
-                print "    %s" % conp
-            dist = conp.distance
-            if dist is not None:
-                if min_dist is None:
-                    min_dist = dist
-                else:
-                    min_dist = min(min_dist, dist)
-        print
-        print "-"*20
-        """
-
-    def parse(self):
+    def _init_aggregates(self):
         # sets
-        hosts_set_by_service = defaultdict(set)
+        self._hosts_set_by_service = defaultdict(set)
 
         # counters
-        requests_by_state = defaultdict(lambda: 0)
-        count_by_node = defaultdict(lambda: 0)
+        self.requests_by_state = defaultdict(lambda: 0)
+        self.count_by_node = defaultdict(lambda: 0)
 
         # intervals
-        intervals_of_requests = []
-        intervals_by_services = defaultdict(list)
-        intervals_by_names = defaultdict(list)
-        intervals_by_comms = defaultdict(list)
-
-        for instance in self.available_instances:
-            requests_by_state[instance.state] += 1
-
-            interval = Interval(instance.from_seconds,
-                                instance.to_seconds)
-            intervals_of_requests.append(interval)
+        self._intervals_of_requests = IntervalsBuilder()
+        self._intervals_by_services = defaultdict(IntervalsBuilder)
+        self._intervals_by_names = defaultdict(IntervalsBuilder)
+        self._intervals_by_comms = defaultdict(IntervalsBuilder)
+
+    def _aggregate(self, instance):
+        """ Count an available instance and collect its intervals. """
+        self.requests_by_state[instance.state] += 1
+
+        last_ins = None
+        for leaf_ins in instance:
+            if last_ins:
+                comm_key = (last_ins.to_pace.from_node.id_,
+                            leaf_ins.from_pace.to_node.id_)
+                self._intervals_by_comms[comm_key].add(
+                    last_ins.host, last_ins.to_seconds,
+                    leaf_ins.host, leaf_ins.from_seconds)
+            else:
+                first_ins = leaf_ins
 
-            last_ins = None
-            for leaf_ins in instance:
-                if last_ins:
-                    comm_key = (last_ins.to_pace.from_node.id_,
-                                leaf_ins.from_pace.to_node.id_)
-                    interval = Interval(last_ins.to_seconds,
-                                        leaf_ins.from_seconds)
-                    intervals_by_comms[comm_key].append(interval)
+            self._intervals_by_services[leaf_ins.service].add(
+                leaf_ins.host, leaf_ins.from_seconds,
+                leaf_ins.host, leaf_ins.to_seconds)
+            self._intervals_by_names[leaf_ins.name].add(
+                leaf_ins.host, leaf_ins.from_seconds,
+                leaf_ins.host, leaf_ins.to_seconds)
 
-                interval = Interval(leaf_ins.from_seconds,
-                                    leaf_ins.to_seconds)
-                intervals_by_services[leaf_ins.service].append(interval)
-                intervals_by_names[leaf_ins.name].append(interval)
+            self._hosts_set_by_service[leaf_ins.service].add(leaf_ins.host)
 
-                hosts_set_by_service[leaf_ins.service].add(leaf_ins.host)
+            last_ins = leaf_ins
 
-                last_ins = leaf_ins
+        self._intervals_of_requests.add(first_ins.host,
+                                        instance.from_seconds,
+                                        last_ins.host,
+                                        instance.to_seconds)
 
-            count_by_node[instance.from_node.id_] += 1
-            for p in instance.iterall():
-                count_by_node[p.to_node.id_] += 1
+        self.count_by_node[instance.from_node.id_] += 1
+        for p in instance.iterall():
+            self.count_by_node[p.to_node.id_] += 1
 
+    def _build_aggregates(self, offsets=None):
         self.active_by_service = defaultdict(lambda: 0)
-        self.requests_by_state = requests_by_state
-        self.count_by_node = count_by_node
 
-        self.intervals_requests = Intervals(intervals_of_requests)
+        self.intervals_requests = self._intervals_of_requests.build(offsets)
         self.intervals_requests.wall_time()
 
         self.intervals_by_services = {}
         self.intervals_by_names = {}
         self.intervals_by_comms = {}
 
-        for service, host_set in hosts_set_by_service.iteritems():
+        for service, host_set in self._hosts_set_by_service.items():
             self.active_by_service[service] = len(host_set)
-        for service, intervals in intervals_by_services.iteritems():
-            self.intervals_by_services[service] = Intervals(intervals)
-        for name, intervals in intervals_by_names.iteritems():
-            self.intervals_by_names[name] = Intervals(intervals)
-        for comm, intervals in intervals_by_comms.iteritems():
-            self.intervals_by_comms[comm] = Intervals(intervals)
+        # NOTE: services and names without instances yet are reported empty
+        for service in self.graph.services:
+            self.intervals_by_services[service] = \
+                self._intervals_by_services[service].build(offsets)
+        for name in self.graph.names:
+            self.intervals_by_names[name] = \
+                self._intervals_by_names[name].build(offsets)
+        for comm, builder in self._intervals_by_comms.items():
+            self.intervals_by_comms[comm] = builder.build(offsets)
+
+        # NOTE: the raw intervals are dropped once built.
+        self._intervals_of_requests = None
+        self._intervals_by_services = None
+        self._intervals_by_names = None
+        self._intervals_by_comms = None
+
+    def parse(self):
+        self._init_aggregates()
+        for instance in self.available_instances:
+            self._aggregate(instance)
+        self._build_aggregates()
 
     def count(self, node_id):
         return self.count_by_node.get(node_id, 0)
@@ -356,89 +797,90 @@ class Engine(object):
         for comm in comm_keys:
             report.register("time " + str(comm) + " avg",
                             self.intervals_by_comms[comm].average())
+        report.blank()
+        for name in name_keys:
+            report.register_percentiles("time " + name,
+                                        self.intervals_by_names[name],
+                                        (95, 99))
 
         report.export()
 
     def extract_intervals(self, targets, cut_targets, cut_edge):
-        end_dict = defaultdict(list)
-        m_targets = set()
-        for target in targets:
-            m_targets |= target
-        for target in m_targets:
-            if target[0] not in self.graph.tracked_nodes_by_id:
-                raise RuntimeError("Node#%s cannot find in graph"
-                                   % target[0])
-            if target[1] not in self.graph.tracked_nodes_by_id:
-                raise RuntimeError("Node#%s cannot find in graph"
-                                   % target[1])
-            end_dict[target[1]].append(target)
-
-        end_c_dict = defaultdict(list)
-        m_cut_targets = set()
-        for target in cut_targets:
-            m_cut_targets |= target
-        for target in m_cut_targets:
-            if target[0] not in self.graph.tracked_nodes_by_id:
-                raise RuntimeError("Node#%s cannot find in graph"
-                                   % target[0])
-            if target[1] not in self.graph.tracked_nodes_by_id:
-                raise RuntimeError("Node#%s cannot find in graph"
-                                   % target[1])
-            end_c_dict[target[1]].append(target)
-
-        ret_dict = defaultdict(list)
-        ret_c_dict = defaultdict(list)
-        ret_cutted = []
-        for instance in self.available_instances:
-            tracking = Tracking()
-            is_cut = False
-            cut_time = None
-            for p in instance.iterall():
-                edge = p.edge
-                from_node_id = p.from_node.id_
-                node_id = p.to_node.id_
-                tracking.step(from_node_id, p.log.seconds, node_id)
-                if node_id in end_dict:
-                    for target in end_dict[node_id]:
-                        start = tracking[target[0]]
-                        if start is not None:
-                            end = p.log.seconds
-                            ret_dict[target].append(Interval(start, end))
-                if is_cut is False and node_id in end_c_dict:
-                    for target in end_c_dict[node_id]:
-                        start = tracking[target[0]]
-                        if start is not None:
-                            end = p.log.seconds
-                            ret_c_dict[target].append(Interval(start, end))
-                if edge is cut_edge and is_cut is False:
-                    is_cut = True
-                    cut_time = p.log.seconds
-
-            if cut_time is not None:
-                ret_cutted.append(Interval(cut_time, instance.to_seconds))
-
-        intervals_dict = {}
-        for target in targets:
-            content = []
-            for t in target:
-                content.extend(ret_dict[t])
-            intervals_dict[target] = Intervals(content)
-        c_intervals_dict = {}
-        for target in cut_targets:
-            content = []
-            for t in target:
-                content.extend(ret_c_dict[t])
-            c_intervals_dict[target] = Intervals(content)
-        cutted_intervals = Intervals(ret_cutted)
+        key = IntervalQuery.make_key(targets, cut_targets, cut_edge)
+        if key not in self.results:
+            query = IntervalQuery(self.graph, targets, cut_targets, cut_edge)
+            for instance in self.available_instances:
+                query.walk(instance)
+            self.results[key] = query.build()
+        return self.results[key]
+
+
+class StreamEngine(Engine):
+    """ The statistics engine to add instances one at a time.
+
+    An added instance is not referred by the engine after its counters,
+    constraints and intervals are aggregated, so that it can be dropped,
+    e.g. as emitted by ParserEngine.feed. The interval queries, usually
+    from BenchDriverBase.interval_queries, must be given in advance. The
+    clock offsets are solved and applied to the intervals in finish().
+    """
+    def __init__(self, graph, queries=()):
+        assert isinstance(graph, MasterGraph)
+        self.graph = graph
+        self.error_instances = []
+        self.constraints = Constraints()
+        self.queries = []
+        for targets, cut_targets, cut_edge in queries:
+            self.queries.append(
+                IntervalQuery(graph, targets, cut_targets, cut_edge))
+        self.results = {}
+
+        self._init_check()
+        self._init_aggregates()
+
+    def add(self, instance):
+        if self._check(instance, self.constraints):
+            self._aggregate(instance)
+            for query in self.queries:
+                query.walk(instance)
+
+    def finish(self, log_collector=None):
+        offsets = self.relax_constraints(self.constraints, log_collector)
+        self._build_aggregates(offsets)
+        for query in self.queries:
+            self.results[query.key] = query.build(offsets)
+        self.queries = []
 
-        return intervals_dict, c_intervals_dict, cutted_intervals
+    def extract_intervals(self, targets, cut_targets, cut_edge):
+        key = IntervalQuery.make_key(targets, cut_targets, cut_edge)
+        if key not in self.results:
+            raise RuntimeError("Intervals of %s are not queried in advance!"
+                               % (key,))
+        return self.results[key]
 
 
 class Tracking(object):
-    def __init__(self):
-        self.node_history = {}
-        self.node_tracked = {}
-        self.mask_tracked = {}
+    """ Track the last value stepped from every node of a path.
+
+    The value of a node is masked if it is not tracked again since the path
+    last left the current node, so that the intervals ending at the node
+    don't start before that. Instead of a snapshot of the values per step,
+    the values are stamped by the step that tracked them, and the current
+    node masks the stamps up to the step that last left it. The node ids
+    index the arrays, and reset() starts a new path without clearing them.
+    """
+    def __init__(self, size):
+        self.values = [None] * size
+        self.stamps = [0] * size
+        self.left = [0] * size
+        self.clock = 0
+        self.base = 0
+        self.mask = 0
+        self.key = None
+
+    def reset(self):
+        self.base = self.clock
+        self.mask = self.clock
         self.key = None
 
     def step(self, from_key, value, to_key):
@@ -446,17 +888,20 @@ class Tracking(object):
         if self.key is not None:
             assert self.key == from_key
         self.key = to_key
-        self.node_history[from_key] = self.node_tracked.copy()
-        self.node_tracked[from_key] = value
-        self.mask_tracked = self.node_history.get(to_key, {})
+        self.left[from_key] = self.clock
+        self.clock += 1
+        self.stamps[from_key] = self.clock
+        self.values[from_key] = value
+        # NOTE: the stamps of the previous paths are up to base.
+        self.mask = self.left[to_key]
+        if self.mask < self.base:
+            self.mask = self.base
 
     def __getitem__(self, key):
-        tracked = self.node_tracked.get(key)
-        masked = self.mask_tracked.get(key)
-        if tracked == masked:
-            return None
+        if self.stamps[key] > self.mask:
+            return self.values[key]
         else:
-            return tracked
+            return None
 
 
 class Constraints(object):
@@ -478,8 +923,8 @@ class Constraints(object):
     def group_by_host(self):
         host_dict = defaultdict(dict)
         host_dict1 = defaultdict(list)
-        for from_host, to_dict in self.constraints_by_from.iteritems():
-            for to_host, constraint in to_dict.iteritems():
+        for from_host, to_dict in self.constraints_by_from.items():
+            for to_host, constraint in to_dict.items():
                 conp = host_dict[from_host].get(to_host)
                 if not conp:
                     conp = ConstraintPair(constraint)
@@ -490,8 +935,9 @@ class Constraints(object):
                 else:
                     conp.set(constraint)
 
-        host_keys = host_dict1.keys()
-        host_keys.sort(key=lambda host: len(host_dict1[host]), reverse=True)
+        # NOTE: the ties are broken by names, not by the order of hashes.
+        host_keys = sorted(host_dict1,
+                           key=lambda host: (-len(host_dict1[host]), host))
         ret_list = []
         for key in host_keys:
             c_list = host_dict1[key]
@@ -508,8 +954,8 @@ class Constraints(object):
 
     def __str__(self):
         ret_str = "Constraints(%d):" % self.size
-        for to_dict in self.constraints_by_from.itervalues():
-            for cons in to_dict.itervalues():
+        for to_dict in self.constraints_by_from.values():
+            for cons in to_dict.values():
                 if cons.violated:
                     ret_str += "\n   %s" % cons
         return ret_str
@@ -585,213 +1031,176 @@ class Constraint(object):
                % (self.from_host, self.to_host, self.offset)
 
 
-class HostConstraint(object):
-    def __init__(self, name):
-        self.name = name
-        self.low = float("-inf")
-        self.high = float("inf")
-
-        # history
-        self.ll = None
-        self.hh = None
-
-        self.constraints = []
-
-    def change(self, low, high):
-        assert self.low <= low\
-            and low <= high\
-            and high <= self.high
-
-        if self.low != low or self.high != high:
-            self.ll = self.low
-            self.hh = self.high
-            self.low = low
-            self.high = high
-            return True
-        else:
-            return False
-
-    def relax(self):
-        count = 0
-        changed_hosts = set()
-        for cons in self.constraints:
-            hosts = cons.relax()
-            count += 1
-            for host in hosts:
-                changed_hosts.add(host)
-        return changed_hosts, count
-
-    @property
-    def determined(self):
-        return self.low == self.high
-
-    @property
-    def ready(self):
-        if self.low != float("-inf") and self.high != float("inf") \
-                and self.low != self.high:
-            return True
-        else:
-            return False
-
-    def adjust(self, distance):
-        if self.ready:
-            # This may introduce offsets even in single-host mode
-            if self.low + 2 * distance > self.high:
-                result = (self.low + self.high)/2
-                self.change(result, result)
-                return True
-            guess = self.low + distance
-            if guess > 0:
-                assert guess + distance <= self.high
-                self.change(guess, guess)
-                return True
-            guess = self.high - distance
-            if guess < 0:
-                assert guess - distance >= self.low
-                self.low = guess
-                self.high = guess
-                return True
-            self.change(0, 0)
-            return True
-        else:
-            return False
-
-    def adjust_side(self, distance):
-        if self.low == float("-inf") and self.high == float("inf"):
-            return False
-        elif self.low == float("-inf"):
-            if self.high - distance >= 0:
-                target = 0
-            else:
-                target = self.high - distance
-            self.change(target, target)
-            return True
-        elif self.high == float("inf"):
-            if self.low + distance <= 0:
-                target = 0
-            else:
-                target = self.low + distance
-            self.change(target, target)
-            return True
-        else:
-            return False
-
-    def adjust_none(self):
-        assert self.low == float("-inf")
-        assert self.high == float("inf")
-        self.change(0, 0)
-
-    def __repr__(self):
-        if self.determined:
-            return "<Host %s is %.5f, %d>" \
-                   % (self.name, self.low, len(self.constraints))
-        else:
-            return "<Host %s, (%.5f, %.5f), %d>" \
-                   % (self.name, self.low, self.high, len(self.constraints))
-
-
-class DirectedConstraint(object):
-    def __init__(self, from_host, to_host, r_offset, offset):
-        self.from_ = from_host
-        self.to_ = to_host
-        if r_offset is None:
-            self.low = float("-inf")
-        else:
-            self.low = -r_offset
-        if offset is None:
-            self.high = float("inf")
-        else:
-            self.high = offset
-
-    def relax(self):
-        changed = []
-        low = max(self.low, self.to_.low - self.from_.high)
-        high = min(self.high, self.to_.high - self.from_.low)
-        if low > high:
-            raise RuntimeError("Constraint offset %s violated!" % self)
-        self.low = low
-        self.high = high
-
-        from_l = max(self.from_.low, self.to_.low - self.high)
-        from_h = min(self.from_.high, self.to_.high - self.low)
-        if from_l > from_h:
-            raise RuntimeError("Constraint from %s violated!" % self)
-        try:
-            if self.from_.change(from_l, from_h):
-                changed.append(self.from_)
-        except AssertionError:
-            raise RuntimeError("Constraint from_ %s violated!" % self)
-
-        to_l = max(self.to_.low, self.from_.low + self.low)
-        to_h = min(self.to_.high, self.from_.high + self.high)
-        if to_l > to_h:
-            raise RuntimeError("Constraint to %s violated!" % self)
-        try:
-            if self.to_.change(to_l, to_h):
-                changed.append(self.to_)
-        except AssertionError:
-            raise RuntimeError("Constraint to_ %s violated!" % self)
-
-        return changed
-
-    def __repr__(self):
-        return "<DCon %s->%s (%s, %s)>" \
-               % (self.from_, self.to_, self.low, self.high)
-
-
-class CausalEngine(object):
-    def __init__(self, host_dict, conp_list, distance):
-        self.distance = distance
-        self.hosts = {}
-        self.unknown_hosts = set()
-        self.determined_hosts = set()
-        for host in host_dict.iterkeys():
-            c_host = HostConstraint(host)
-            self.hosts[host] = c_host
-            self.unknown_hosts.add(c_host)
-
+class ClockSolver(object):
+    """ Solve the clock offsets of hosts as difference constraints.
+
+    A ConstraintPair from host A to host B bounds the offsets by
+    x_B - x_A <= offset and x_A - x_B <= r_offset, narrowed by the margin
+    so that the corrected messages still take some time. They are the
+    edges of a graph, and in every connected component of hosts, the
+    host with the most constraints is the reference of offset 0. The
+    shortest paths from and to the reference are the feasible intervals
+    of the offsets, by the queue-based Bellman-Ford in near-linear time
+    for the sparse constraints. The offset of a host is then the greatest
+    solution under max(0, lower bound), so a host is not adjusted unless
+    it has to be. If the margin makes a component infeasible, it is
+    halved until 0. A component still infeasible has a negative cycle of
+    hosts, which is reported in cycles and the hosts are not adjusted.
+    So is a pair of negative distance, as a cycle of its two hosts.
+    Neither are the hosts of offsets below the timestamp resolution.
+    """
+    MARGIN_RETRIES = 3
+
+    def __init__(self, conp_list, margin):
+        # NOTE: a negative margin would loosen the constraints.
+        self.margin = max(0, margin)
+        self.edges = defaultdict(list)
+        self.r_edges = defaultdict(list)
+        degrees = defaultdict(int)
+        self.pair_cycles = []
         for conp in conp_list:
-            from_host = self.hosts[conp.from_host]
-            to_host = self.hosts[conp.to_host]
-            dcon = DirectedConstraint(from_host, to_host,
-                                      conp.r_offset, conp.offset)
-            from_host.constraints.append(dcon)
-            to_host.constraints.append(dcon)
+            degrees[conp.from_host] += 1
+            degrees[conp.to_host] += 1
+            if conp.distance is not None and conp.distance < 0:
+                self.pair_cycles.append([conp.from_host, conp.to_host])
+            if conp.offset is not None:
+                self.edges[conp.from_host].append(
+                    (conp.to_host, conp.offset))
+                self.r_edges[conp.to_host].append(
+                    (conp.from_host, conp.offset))
+            if conp.r_offset is not None:
+                self.edges[conp.to_host].append(
+                    (conp.from_host, conp.r_offset))
+                self.r_edges[conp.from_host].append(
+                    (conp.to_host, conp.r_offset))
+        # NOTE: the ties are broken by names, not by the order of hashes.
+        self.hosts = sorted(degrees, key=lambda host: (-degrees[host], host))
+
+        self.low = {}
+        self.high = {}
+        self.offsets = {}
+        self.margins = {}
+        self.cycles = []
         self.counter = 0
 
-    def relax(self, i_host):
-        init_host = self.hosts[i_host]
-        init_host.adjust_none()
-
-        a_host = init_host
-        while True:
-            self.determined_hosts.add(a_host)
-            self.unknown_hosts.remove(a_host)
-            if not self.unknown_hosts:
-                break
-
-            self.relax_all(a_host)
-
-            a_host = None
-            for host in self.unknown_hosts:
-                if host.adjust(self.distance):
-                    a_host = host
+    def _components(self):
+        """ Yield the hosts of components, the reference first. """
+        visited = set()
+        for ref in self.hosts:
+            if ref in visited:
+                continue
+            visited.add(ref)
+            component = [ref]
+            for host in component:
+                for to_host, _ in self.edges[host] + self.r_edges[host]:
+                    if to_host not in visited:
+                        visited.add(to_host)
+                        component.append(to_host)
+            yield component
+
+    def _relax(self, edges, hosts, dists, margin):
+        """ Relax the edges from the distances of hosts by the queue.
+
+        Return the shortest distances and None, or None and the hosts of
+        a negative cycle.
+        """
+        dists = dict(dists)
+        lengths = dict.fromkeys(dists, 0)
+        preds = {}
+        queue = deque(host for host in hosts if dists[host] != INF)
+        queued = set(queue)
+        while queue:
+            host = queue.popleft()
+            queued.remove(host)
+            for to_host, weight in edges[host]:
+                self.counter += 1
+                dist = dists[host] + weight - margin
+                if dist < dists[to_host]:
+                    dists[to_host] = dist
+                    preds[to_host] = host
+                    lengths[to_host] = lengths[host] + 1
+                    # NOTE: a shortest path has less edges than hosts.
+                    if lengths[to_host] >= len(dists):
+                        return None, self._cycle(preds, to_host)
+                    if to_host not in queued:
+                        queued.add(to_host)
+                        queue.append(to_host)
+        return dists, None
+
+    @staticmethod
+    def _cycle(preds, host):
+        for _ in range(len(preds)):
+            host = preds[host]
+        cycle = [host]
+        while preds[cycle[-1]] != host:
+            cycle.append(preds[cycle[-1]])
+        cycle.reverse()
+        return cycle
+
+    def _solve(self, component, margin):
+        ref = component[0]
+        init = dict.fromkeys(component, INF)
+        init[ref] = 0
+        to_ref, cycle = self._relax(self.r_edges, component, init, margin)
+        if cycle is not None:
+            # NOTE: the cycle is found on the reversed edges.
+            cycle.reverse()
+            return cycle
+        from_ref, cycle = self._relax(self.edges, component, init, margin)
+        if cycle is not None:
+            return cycle
+        offsets, cycle = self._relax(
+            self.edges, component,
+            dict((host, max(0, -to_ref[host])) for host in component),
+            margin)
+        if cycle is not None:
+            return cycle
+        for host in component:
+            self.low[host] = -to_ref[host]
+            self.high[host] = from_ref[host]
+            self.offsets[host] = offsets[host]
+            self.margins[host] = margin
+        return None
+
+    def solve(self):
+        for component in self._components():
+            hosts = set(component)
+            cycles = [cycle for cycle in self.pair_cycles
+                      if cycle[0] in hosts]
+            if cycles:
+                self.cycles.extend(cycles)
+                for host in component:
+                    self.offsets[host] = 0
+                continue
+            margin = self.margin
+            for _ in range(self.MARGIN_RETRIES):
+                cycle = self._solve(component, margin)
+                if cycle is None:
                     break
-            if a_host is None:
-                for host in self.unknown_hosts:
-                    if host.adjust_side(self.distance):
-                        a_host = host
-                        break
-            if a_host is None:
-                a_host = self.unknown_hosts[0]
-                a_host.adjust_none()
-
-    def relax_all(self, host):
-        changed_hosts = {host}
-        while changed_hosts:
-            next_hosts = set()
-            for host in changed_hosts:
-                hosts, count = host.relax()
-                self.counter += count
-                next_hosts.update(hosts)
-            changed_hosts = next_hosts
+                margin /= 2
+            else:
+                cycle = self._solve(component, 0)
+            if cycle is not None:
+                self.cycles.append(cycle)
+                for host in component:
+                    self.offsets[host] = 0
+        for host, offset in self.offsets.items():
+            if abs(offset) < RESOLUTION:
+                self.offsets[host] = 0
+        return self.offsets
+
+    def cycle_str(self, cycle):
+        weights = dict(((from_host, to_host), weight)
+                       for from_host in cycle
+                       for to_host, weight in self.edges[from_host])
+        total = sum(weights[(from_host, to_host)] for from_host, to_host
+                    in zip(cycle, cycle[1:] + cycle[:1]))
+        return "%s -> %s: %.5f" % (" -> ".join(cycle), cycle[0], total)
+
+    def host_str(self, host):
+        if host not in self.low:
+            return "<Host %s is %.5f, infeasible>" \
+                   % (host, self.offsets[host])
+        return "<Host %s is %.5f, (%.5f, %.5f), margin %.5f>" \
+               % (host, self.offsets[host], self.low[host],
+                  self.high[host], self.margins[host])
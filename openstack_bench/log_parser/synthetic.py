@@ -0,0 +1,74 @@
+# Copyright (c) 2016 Yingxin Cheng
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+""" Synthetic bench events of the scheduler driver, for the benchmarks and
+the tests of the log parser. """
+
+from collections import defaultdict
+from os import path
+import uuid
+
+from openstack_bench.utils import bench_format
+
+
+def write_retry_logs(folder, requests, retries, nodes=("node1",),
+                     skews=None):
+    """ Write the events of requests retried on compute nodes.
+
+    The attempts go to the nodes in turn, and the clocks of hosts are
+    skewed by the seconds in skews.
+    """
+    events = defaultdict(list)
+    clock = [1476230400.0]
+    skews = skews or {}
+
+    def emit(service, host, msg):
+        clock[0] += 0.001
+        events[(service, host)].append(
+            bench_format.format_event(clock[0] + skews.get(host, 0),
+                                      service, host, None, msg))
+
+    for i in range(requests):
+        name = "req%d" % i
+        u = str(uuid.uuid4())
+        emit("api", "ctl", "%s received" % name)
+        emit("api", "ctl", "%s sent/retried" % name)
+        for attempt in range(1, retries + 2):
+            node = nodes[(attempt - 1) % len(nodes)]
+            emit("conductor", "ctl", "%s,%s received" % (name, u))
+            emit("conductor", "ctl", "%s attempts %d" % (u, attempt))
+            emit("conductor", "ctl", "%s sent scheduler" % u)
+            emit("scheduler", "sche1", "%s received" % u)
+            emit("scheduler", "sche1", "%s start scheduling" % u)
+            emit("scheduler", "sche1", "-- start_db")
+            emit("scheduler", "sche1", "-- finish_db")
+            emit("scheduler", "sche1", "%s finish scheduling" % u)
+            emit("scheduler", "sche1", "%s selected %s" % (u, node))
+            emit("conductor", "ctl", "%s decided %s" % (u, node))
+            emit("conductor", "ctl", "%s sent %s" % (name, node))
+            emit("compute", node, "%s received" % name)
+            if attempt <= retries:
+                emit("compute", node, "%s fail: retry" % name)
+                emit("compute", node, "%s sent/retried" % name)
+                emit("compute", node, "%s finished: rescheduled" % name)
+            else:
+                emit("compute", node, "%s success" % name)
+                emit("compute", node, "%s finished: active" % name)
+        emit("api", "ctl", "%s api returned" % name)
+
+    for (service, host), lines in events.items():
+        with open(path.join(folder, "BENCH-%s-%s%s"
+                            % (service, host, bench_format.EVENTS_SUFFIX)),
+                  "w") as writer:
+            writer.write("\n".join(lines) + "\n")
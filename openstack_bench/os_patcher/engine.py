@@ -42,7 +42,7 @@ class PatchEngine(object):
             self.errors = "Already subvirted!"
             return
         try:
-            self.patcher.printer("Patching...")
+            self.patcher.report("Patching...")
 
             # Patch repository specific modules
             self.patcher.stub_out_modules()
@@ -56,7 +56,7 @@ class PatchEngine(object):
             points = self.driver_obj.points.values()
             self.patcher.inject_logs(points, self)
 
-            self.patcher.printer("Patching Success!")
+            self.patcher.report("Patching Success!")
             self.subvirted = True
         except Exception:
             self.errors = traceback.format_exc()
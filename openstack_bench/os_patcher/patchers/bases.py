@@ -14,12 +14,19 @@
 
 
 import abc
+import atexit
+import collections
+import os
+import threading
+import time
 import traceback
 
+from oslo_context import context
 from oslo_log import log as logging
 
-from openstack_bench import interceptions
+from openstack_bench.config import CONF_BENCH
 from openstack_bench.os_patcher import patching as bench_patching
+from openstack_bench.utils import bench_format
 
 
 LOG = logging.getLogger(__name__)
@@ -49,6 +56,16 @@ class BasePatcher(object):
         self.patched = ""
         self.failed = ""
 
+        # NOTE: the fd of the event sink is opened with O_APPEND, so that
+        # each event is a single atomic write even if it is shared by the
+        # forked workers of the service.
+        self.sink = None
+
+        # buffered mode
+        self.buffered = CONF_BENCH.event_mode == "buffered"
+        self._events = collections.deque()
+        self._writer_pid = None
+
     def stub_entrypoint(self, patch_func):
         if self.PATCH_POINT == _UNDFINED:
             raise RuntimeError("Undefined patch entrypoint!")
@@ -92,6 +109,11 @@ class BasePatcher(object):
                 "log_file",
                 folder + "BENCH-" + self.service_name + "-"
                 + self.host_name + ".log")
+            if CONF_BENCH.event_sink:
+                self.sink = os.open(
+                    folder + "BENCH-" + self.service_name + "-"
+                    + self.host_name + bench_format.EVENTS_SUFFIX,
+                    os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
 
         # Enable debug mode
         self.conf("debug", is_debug)
@@ -103,8 +125,10 @@ class BasePatcher(object):
         bench_patching.AopPatch.logger = staticmethod(self.error)
         bench_patching.AopPatch.printer = staticmethod(self.printer)
 
-        i_point = interceptions.ReleasePoint(
-            after=lambda arg:
+        # NOTE: the report is not an event, it always goes to oslo.log
+        bench_patching.AopPatch(
+            "oslo_log.log.setup",
+            after=lambda arg: self.report(
                 "Bench initiated %s %s!\n"
                 "Errors:\n%s\n"
                 "Patched:\n%s"
@@ -115,15 +139,10 @@ class BasePatcher(object):
                     engine.errors,
                     self.patched,
                     self.skipped,
-                    self.failed))
-        point = interceptions.AnalysisPoint("oslo_log.log.setup",
-                                            project=self.REPOSITORY)
-        point[None] = i_point
-
-        _points = points[:]
-        _points.append(point)
+                    self.failed)),
+            direct=True)
 
-        for point in _points:
+        for point in points:
             if point.project != self.REPOSITORY:
                 raise RuntimeError("Project don't match: %s, %s"
                                    % (point.project, self.REPOSITORY))
@@ -149,6 +168,17 @@ class BasePatcher(object):
                 print("Traceback:\n%s" % e_stack)
                 self.failed += "   %s\n" % point.inject_point
 
+        if self.buffered:
+            # NOTE: the forked workers leave by os._exit() when the service
+            # is stopped, which skips the atexit flush.
+            try:
+                bench_patching.AopPatch("oslo_service.service.Services.stop",
+                                        after=lambda arg: self.flush(),
+                                        direct=True)
+            except Exception:
+                print("Failed to load flush point at service stop!")
+                self.failed += "   oslo_service.service.Services.stop\n"
+
     # helper methods
     def patch(self, name, attr, add=False):
         """ Patch module name with attr """
@@ -159,6 +189,70 @@ class BasePatcher(object):
 
     # loggers
     def printer(self, msg):
+        seconds = time.time()
+        ctx = context.get_current()
+        request_id = ctx.request_id if ctx else None
+        if self.buffered:
+            if self._writer_pid != os.getpid():
+                self._start_writer()
+            self._events.append((seconds, request_id, msg))
+        else:
+            self._write([self._format(seconds, request_id, msg)])
+
+    def _format(self, seconds, request_id, msg):
+        if request_id and request_id.startswith("req-"):
+            request_id = request_id[4:]
+        return bench_format.format_event(seconds,
+                                         self.service_name,
+                                         self.host_name,
+                                         request_id,
+                                         msg)
+
+    def _write(self, events):
+        if self.sink is None:
+            for event in events:
+                LOG.warn(event)
+        elif events:
+            # bypass the handlers and formatters of oslo.log
+            data = "".join(event + "\n" for event in events)
+            if not isinstance(data, bytes):
+                data = data.encode("utf-8")
+            os.write(self.sink, data)
+
+    def _start_writer(self):
+        """ Start the background writer of the current process.
+
+        The thread is a greenthread if the service is monkey-patched by
+        eventlet. The events inherited from the parent of a forked worker
+        are flushed by the parent.
+        """
+        if self._writer_pid is None:
+            atexit.register(self.flush)
+        pid = os.getpid()
+        self._writer_pid = pid
+        self._events = collections.deque()
+        writer = threading.Thread(target=self._flush_loop, args=(pid,))
+        writer.daemon = True
+        writer.start()
+
+    def _flush_loop(self, pid):
+        interval = CONF_BENCH.event_flush_interval
+        # NOTE: a greenthread is copied into the forked workers, stop it.
+        while pid == os.getpid():
+            time.sleep(interval)
+            self.flush()
+
+    def flush(self):
+        """ Format and write the buffered events in a batch. """
+        if self._writer_pid != os.getpid():
+            return
+        events = self._events
+        lines = []
+        while events:
+            lines.append(self._format(*events.popleft()))
+        self._write(lines)
+
+    def report(self, msg):
         LOG.warn(self.log_prefix + msg)
 
     def error(self, msg):
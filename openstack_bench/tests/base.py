@@ -0,0 +1,49 @@
+# Copyright (c) 2016 Yingxin Cheng
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import shutil
+import tempfile
+import unittest
+
+from openstack_bench import bench_drivers
+from openstack_bench.log_parser import synthetic
+from openstack_bench.log_parser.log_parser import LogCollector
+from openstack_bench.log_parser.parser_engine import ParserEngine
+from openstack_bench.log_parser.state_graph import MasterGraph
+
+
+class LogTestCase(unittest.TestCase):
+    """ A test case parsing synthetic logs in a temporary folder. """
+
+    def setUp(self):
+        super(LogTestCase, self).setUp()
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.driver = bench_drivers.init_driver(bench_drivers.DEFAULT_DRIVER)
+
+    def write_logs(self, requests, retries, folder=None, **kwargs):
+        synthetic.write_retry_logs(folder or self.folder, requests, retries,
+                                   **kwargs)
+
+    def build_graph(self):
+        return MasterGraph.build_from_driver(self.driver)
+
+    def collect(self, folder=None):
+        log_collector = LogCollector(folder or self.folder, self.driver,
+                                     cache=False)
+        log_collector.process_logs()
+        return log_collector
+
+    def parse(self, log_collector, workers=1):
+        return ParserEngine(self.build_graph(), log_collector).parse(workers)
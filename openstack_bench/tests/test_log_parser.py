@@ -0,0 +1,76 @@
+# Copyright (c) 2016 Yingxin Cheng
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import unittest
+
+from openstack_bench.log_parser.log_parser import LogCollector
+from openstack_bench.log_parser.parser_engine import ParserEngine
+from openstack_bench.tests import base
+
+
+class TestLogCollector(base.LogTestCase):
+    def test_oslo_log_next_to_event_sink(self):
+        self.write_logs(5, 1)
+        with open(os.path.join(self.folder, "BENCH-compute-node1.log"),
+                  "w") as writer:
+            writer.write(
+                "2016-10-12 00:00:00.000 WARNING nova.bench [-] "
+                "BENCH-compute-node1: Bench initiated!\n"
+                "2016-10-12 00:00:01.000 ERROR nova.bench [-] "
+                "BENCH-compute-node1: Error in hook!\n")
+        log_collector = self.collect()
+        self.assertEqual(["BENCH-compute-node1.events"],
+                         [log_file.name for log_file in
+                          log_collector.service_host_dict["compute"].values()])
+
+    def test_follow_buffered_events(self):
+        full = os.path.join(self.folder, "full")
+        part = os.path.join(self.folder, "part")
+        os.mkdir(full)
+        os.mkdir(part)
+        self.write_logs(20, 1, folder=full)
+        contents = {}
+        for name in os.listdir(full):
+            with open(os.path.join(full, name)) as reader:
+                lines = reader.read().splitlines(True)
+            # NOTE: the batches of two workers are written out of order.
+            batches = [lines[i:i + 7] for i in range(0, len(lines), 7)]
+            for i in range(0, len(batches) - 1, 2):
+                batches[i], batches[i + 1] = batches[i + 1], batches[i]
+            contents[name] = [line for batch in batches for line in batch]
+            open(os.path.join(part, name), "w").close()
+
+        log_collector = LogCollector(part, self.driver, follow=True)
+        engine = ParserEngine(self.build_graph(), log_collector)
+        rounds = 4
+        # NOTE: the last round finds nothing new.
+        for i in range(rounds + 1):
+            for name, lines in contents.items():
+                size = len(lines)
+                with open(os.path.join(part, name), "a") as writer:
+                    writer.writelines(lines[size * i // rounds:
+                                            size * (i + 1) // rounds])
+            instances = engine.follow(log_collector.follow())
+        self.assertFalse(log_collector.has_pending)
+        for log_file in log_collector.log_files:
+            seconds = [log.seconds for log in log_file.log_lines]
+            self.assertEqual(sorted(seconds), seconds)
+        self.assertEqual(20, len(instances))
+        for instance in instances.values():
+            self.assertFalse(instance.is_failed, instance.fail_message)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+# Copyright (c) 2016 Yingxin Cheng
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import glob
+import os
+import unittest
+
+from openstack_bench.bench_drivers.driver_scheduler import \
+    BenchDriverScheduler
+from openstack_bench.log_parser import parser_engine
+from openstack_bench.tests import base
+
+
+class _LoopDriver(BenchDriverScheduler):
+    def build_graph(self):
+        master = super(_LoopDriver, self).build_graph()
+        master.build(10, 10, "scheduler", "filtering")
+        return master
+
+
+class TestNesting(base.LogTestCase):
+
+    def test_retries_across_skewed_hosts(self):
+        # NOTE: the leaf instances of node2 start earlier than the ones of
+        # node1 they are retried from.
+        self.write_logs(20, 3, nodes=("node1", "node2"),
+                        skews={"node2": -0.5})
+        # NOTE: the pool is skipped without another CPU.
+        self.addCleanup(setattr, parser_engine, "_available_cpus",
+                        parser_engine._available_cpus)
+        parser_engine._available_cpus = lambda: 2
+        nested = None
+        for workers in (1, 2):
+            instances = self.parse(self.collect(), workers)
+            self.assertEqual(20, len(instances))
+            for instance in instances.values():
+                self.assertFalse(instance.is_failed, instance.fail_message)
+                self.assertEqual(4, sum(1 for ins in instance
+                                        if ins.graph.name == "compute"))
+            leaves = dict((ident, [repr(ins) for ins in instance])
+                          for ident, instance in instances.items())
+            if nested is None:
+                nested = leaves
+            self.assertEqual(nested, leaves)
+
+    def test_self_loop_edges(self):
+        self.write_logs(5, 0)
+        path = glob.glob(os.path.join(self.folder, "BENCH-scheduler-*"))[0]
+        with open(path) as reader:
+            lines = reader.read().splitlines()
+        with open(path, "w") as writer:
+            for line in lines:
+                writer.write(line + "\n")
+                if line.endswith("finish scheduling"):
+                    loop = line.replace("finish scheduling", "filtering")
+                    writer.write((loop + "\n") * 3)
+        self.driver = _LoopDriver()
+        instances = self.parse(self.collect())
+        self.assertEqual(5, len(instances))
+        for instance in instances.values():
+            self.assertFalse(instance.is_failed, instance.fail_message)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+# Copyright (c) 2016 Yingxin Cheng
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import random
+import unittest
+
+from openstack_bench.log_parser.state_graph import KeywordAutomaton
+from openstack_bench.tests import base
+
+
+def _scan(keywords_bits, text):
+    found = 0
+    for keyword, bit in keywords_bits:
+        if keyword in text:
+            found |= bit
+    return found
+
+
+def _scan_accept(edge, log):
+    return edge.service == log.service and edge.keyword in log.action
+
+
+def _scan_subgraph(graph, log):
+    for sub in graph.graphs:
+        for node in sub.start_nodes:
+            for edge in node.edges:
+                if _scan_accept(edge, log):
+                    return sub
+    return None
+
+
+class TestKeywordAutomaton(unittest.TestCase):
+    def _assert_match(self, keywords, texts):
+        keywords_bits = [(keyword, 1 << i)
+                         for i, keyword in enumerate(keywords)]
+        automaton = KeywordAutomaton(keywords_bits)
+        for text in texts:
+            self.assertEqual(_scan(keywords_bits, text),
+                             automaton.match(text), text)
+
+    def test_overlapping_keywords(self):
+        self._assert_match(
+            ["he", "she", "his", "hers", "s", "ers"],
+            ["", "ushers", "hershe", "his", "sh", "xyz", "hhhers"])
+
+    def test_random_keywords(self):
+        rand = random.Random(0)
+
+        def word(lo, hi):
+            return "".join(rand.choice("abc")
+                           for _ in range(rand.randint(lo, hi)))
+
+        for _ in range(100):
+            keywords = list(set(word(1, 4) for _ in range(8)))
+            self._assert_match(keywords, [word(0, 20) for _ in range(20)])
+
+
+class TestMasterGraph(base.LogTestCase):
+    def test_keyword_bits_by_service(self):
+        graph = self.build_graph()
+        graph.compile()
+        bits = {}
+        for sub in graph.graphs:
+            for edge in list(sub.edges) + list(sub.ignored_edges):
+                self.assertTrue(edge.mask)
+                self.assertFalse(edge.mask & (edge.mask - 1))
+                bits.setdefault((sub.service, edge.keyword), edge.mask)
+                self.assertEqual(bits[(sub.service, edge.keyword)],
+                                 edge.mask)
+        self.assertEqual(len(bits), len(set(bits.values())))
+
+    def test_match_against_scan(self):
+        self.write_logs(10, 2, nodes=("node1", "node2"))
+        graph = self.build_graph()
+        edges = [edge for sub in graph.graphs
+                 for edge in list(sub.edges) + list(sub.ignored_edges)]
+        for log_file in self.collect().log_files:
+            for log in log_file.log_lines:
+                for edge in edges:
+                    self.assertEqual(_scan_accept(edge, log),
+                                     edge.accept(log), (edge, log))
+                self.assertIs(_scan_subgraph(graph, log),
+                              graph.decide_subgraph(log))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,222 @@
+# Copyright (c) 2016 Yingxin Cheng
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import random
+import unittest
+
+from openstack_bench.log_parser.log_parser import LogCollector
+from openstack_bench.log_parser.parser_engine import ParserEngine
+from openstack_bench.log_parser.statistics import ClockSolver
+from openstack_bench.log_parser.statistics import Constraints
+from openstack_bench.log_parser.statistics import Engine
+from openstack_bench.log_parser.statistics import LatencyHistogram
+from openstack_bench.log_parser.statistics import Tracking
+from openstack_bench.tests import base
+
+
+class TestClockOffsets(base.LogTestCase):
+    def _seconds(self, log_collector):
+        return sorted((log.filename, log.seconds)
+                      for log_file in log_collector.log_files
+                      for log in log_file.log_lines)
+
+    def test_follow_rounds(self):
+        full = os.path.join(self.folder, "full")
+        part = os.path.join(self.folder, "part")
+        os.mkdir(full)
+        os.mkdir(part)
+        self.write_logs(20, 3, folder=full, nodes=("node1", "node2"),
+                        skews={"node1": 0.2, "node2": -0.3})
+        graph = self.build_graph()
+
+        log_collector = self.collect(full)
+        instances = self.parse(log_collector)
+        s_engine = Engine(graph, instances, log_collector)
+        expected = self._seconds(log_collector)
+        self.assertTrue(s_engine.requests_to_adjust)
+
+        contents = {}
+        for name in os.listdir(full):
+            with open(os.path.join(full, name)) as reader:
+                contents[name] = reader.read().splitlines(True)
+            open(os.path.join(part, name), "w").close()
+        log_collector = LogCollector(part, self.driver, follow=True)
+        engine = ParserEngine(graph, log_collector)
+        rounds = 4
+        # NOTE: the last round finds nothing new.
+        for i in range(rounds + 1):
+            for name, lines in contents.items():
+                size = len(lines)
+                with open(os.path.join(part, name), "a") as writer:
+                    writer.writelines(lines[size * i // rounds:
+                                            size * (i + 1) // rounds])
+            instances = engine.follow(log_collector.follow())
+            f_engine = Engine(graph, instances, log_collector)
+        self.assertEqual(expected, self._seconds(log_collector))
+        self.assertEqual(s_engine.requests_to_adjust,
+                         f_engine.requests_to_adjust)
+
+
+class TestClockSolver(unittest.TestCase):
+    def _solve(self, messages, margin):
+        constraints = Constraints()
+        for from_host, to_host, offset in messages:
+            constraints.add(from_host, 0, to_host, offset)
+        conp_list, _ = constraints.group_by_host()
+        solver = ClockSolver(conp_list, margin)
+        return solver, solver.solve()
+
+    def test_disconnected_components(self):
+        solver, offsets = self._solve(
+            [("a", "b", -1), ("b", "a", 3), ("c", "d", 2), ("d", "c", 1)],
+            0.1)
+        self.assertEqual([], solver.cycles)
+        self.assertEqual(0, offsets["a"])
+        self.assertAlmostEqual(-1.1, offsets["b"])
+        self.assertEqual(0, offsets["c"])
+        self.assertEqual(0, offsets["d"])
+
+    def test_infeasible_cycle(self):
+        solver, offsets = self._solve(
+            [("a", "b", 1), ("b", "c", 1), ("c", "a", -3)], 0.1)
+        self.assertEqual([["a", "b", "c"]], solver.cycles)
+        self.assertEqual("a -> b -> c -> a: -1.00000",
+                         solver.cycle_str(solver.cycles[0]))
+        self.assertEqual({"a": 0, "b": 0, "c": 0}, offsets)
+
+    def test_negative_distance(self):
+        solver, offsets = self._solve(
+            [("a", "b", -1), ("b", "a", -1), ("a", "c", 1), ("c", "a", 1)],
+            -1)
+        self.assertEqual(0, solver.margin)
+        self.assertEqual([["a", "b"]], solver.cycles)
+        self.assertEqual("a -> b -> a: -2.00000",
+                         solver.cycle_str(solver.cycles[0]))
+        self.assertEqual({"a": 0, "b": 0, "c": 0}, offsets)
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def setUp(self):
+        rand = random.Random(0)
+        self.durations = [rand.lognormvariate(-3, 1.5) for _ in range(5000)]
+        self.durations.extend([0.0, 0.0000001, 0.000001])
+
+    def _histogram(self, durations):
+        histogram = LatencyHistogram()
+        for duration in durations:
+            histogram.add(duration)
+        return histogram
+
+    def _assert_equal(self, expected, histogram):
+        self.assertEqual(dict(expected.counts), dict(histogram.counts))
+        self.assertEqual(expected.count, histogram.count)
+        self.assertAlmostEqual(expected.total, histogram.total)
+        self.assertEqual(expected.min, histogram.min)
+        self.assertEqual(expected.max, histogram.max)
+
+    def test_from_durations(self):
+        self._assert_equal(
+            self._histogram(self.durations),
+            LatencyHistogram.from_durations(self.durations))
+
+    def test_dumps_loads(self):
+        histogram = self._histogram(self.durations)
+        line = histogram.dumps()
+        self.assertNotIn(",", line)
+        loaded = LatencyHistogram.loads(line)
+        self._assert_equal(histogram, loaded)
+        self.assertEqual(line, loaded.dumps())
+
+        empty = LatencyHistogram.loads(LatencyHistogram().dumps())
+        self.assertEqual(0, empty.count)
+        self.assertEqual(0, empty.percentile(50))
+        self.assertRaises(RuntimeError, LatencyHistogram.loads, "h0 1 2 3")
+
+    def test_merge(self):
+        half = len(self.durations) // 2
+        histogram = self._histogram(self.durations[:half])
+        histogram.merge(LatencyHistogram.loads(
+            self._histogram(self.durations[half:]).dumps()))
+        histogram.merge(LatencyHistogram())
+        self._assert_equal(self._histogram(self.durations), histogram)
+
+    def test_percentile_error(self):
+        histogram = self._histogram(self.durations)
+        durations = sorted(self.durations)
+        for percent in (0, 1, 10, 50, 90, 99, 99.9, 100):
+            rank = max(1, -(-len(durations) * percent // 100))
+            exact = durations[int(rank) - 1]
+            value = histogram.percentile(percent)
+            self.assertTrue(
+                exact <= value <= max(exact * LatencyHistogram.GROWTH,
+                                      LatencyHistogram.MIN_DURATION),
+                (percent, exact, value))
+
+
+class _DictTracking(object):
+    """ The Tracking before the stamps, copying the values per step. """
+    def __init__(self):
+        self.node_history = {}
+        self.node_tracked = {}
+        self.mask_tracked = {}
+
+    def step(self, from_key, value, to_key):
+        self.node_history[from_key] = self.node_tracked.copy()
+        self.node_tracked[from_key] = value
+        self.mask_tracked = self.node_history.get(to_key, {})
+
+    def __getitem__(self, key):
+        tracked = self.node_tracked.get(key)
+        masked = self.mask_tracked.get(key)
+        if tracked == masked:
+            return None
+        else:
+            return tracked
+
+
+class TestTracking(unittest.TestCase):
+    def test_loop(self):
+        tracking = Tracking(4)
+        tracking.step(1, "a", 2)
+        tracking.step(2, "b", 3)
+        self.assertEqual(["a", "b"], [tracking[1], tracking[2]])
+        # NOTE: node 1 is not tracked again since the path left node 2.
+        tracking.step(3, "c", 2)
+        self.assertEqual([None, "b", "c"],
+                         [tracking[1], tracking[2], tracking[3]])
+        tracking.reset()
+        self.assertEqual([None] * 4, [tracking[key] for key in range(4)])
+
+    def test_random_paths(self):
+        rand = random.Random(0)
+        size = 6
+        tracking = Tracking(size)
+        value = 0
+        for _ in range(50):
+            tracking.reset()
+            expected = _DictTracking()
+            key = rand.randrange(size)
+            for _ in range(rand.randint(1, 40)):
+                to_key = rand.randrange(size)
+                value += 1
+                tracking.step(key, value, to_key)
+                expected.step(key, value, to_key)
+                key = to_key
+                self.assertEqual([expected[k] for k in range(size)],
+                                 [tracking[k] for k in range(size)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+# Copyright (c) 2016 Yingxin Cheng
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+""" The structured format of bench events.
+
+An event is emitted as:
+    BENCH-@-@<version>@-@<seconds>@-@<service>@-@<host>@-@<request id>
+    @-@<instance id>@-@<instance name>@-@<action>
+
+The unknown fields are "?". The events are either written by oslo.log
+or, with the event sink, one per line to "BENCH-<service>-<host>.events".
+The legacy format is
+"BENCH-<service>-<host>: <instance info> <action>" after the oslo.log
+prefix, and it is still readable by the parser.
+"""
+
+PREFIX = "BENCH-"
+DELIMITER = "@-@"
+MARKER = PREFIX + DELIMITER
+VERSION = "1"
+UNKNOWN = "?"
+EVENTS_SUFFIX = ".events"
+
+_FIELDS = 8
+
+
+def split_instance(info):
+    """ Split the instance info of a hook message into id and name. """
+    instance_id = UNKNOWN
+    instance_name = UNKNOWN
+    if info == "--":
+        pass
+    elif "," in info:
+        info = info.split(",")
+        instance_name = info[0]
+        instance_id = info[1]
+    elif len(info) == 36:
+        instance_id = info
+    else:
+        instance_name = info
+    return instance_id, instance_name
+
+
+def format_event(seconds, service, host, request_id, msg):
+    """ Format the hook message "<instance info> <action>" as an event. """
+    info, _, action = msg.partition(" ")
+    instance_id, instance_name = split_instance(info)
+    return DELIMITER.join((PREFIX, VERSION,
+                           "%.6f" % seconds, service, host,
+                           request_id or UNKNOWN, instance_id,
+                           instance_name, action))
+
+
+def parse_event(line, pos):
+    """ Tokenize the event at pos of the line in a single split.
+
+    Return seconds, service, host, request id, instance id, instance name
+    and action. The seconds are the string as recorded, so that they can
+    be decoded without the rounding of the epoch as a float.
+    """
+    fields = line[pos + len(MARKER):].rstrip("\n").split(DELIMITER,
+                                                         _FIELDS - 1)
+    if fields[0] != VERSION or len(fields) != _FIELDS:
+        raise RuntimeError("Unsupported bench event: %s" % line)
+    return (fields[1], fields[2], fields[3], fields[4],
+            fields[5], fields[6], fields[7])